@@ -0,0 +1,277 @@
+# bench/fakes.py — локальные заглушки всех внешних API бота с задержками и ошибками по заказу
+#
+#   python bench/fakes.py --port 9100 --latency gpt=800,search=300,plantnet=1500 --error-rate 0.01
+#
+# Пути: /telegram/bot<token>/<method>, /telegram/file/bot<token>/<path>, /yandexgpt/..., /search/...,
+# /plantnet/..., /weather/..., /yookassa/v3/payments. Служебные: GET /_stats, GET /_telegram_log, POST /_reset.
+import argparse
+import asyncio
+import io
+import json
+import math
+import random
+import time
+import uuid
+from urllib.parse import parse_qs
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+# Задержки по умолчанию (мс) — порядок величин реальных сервисов
+LATENCY_MS = {"telegram": 40, "telegram_file": 60, "gpt": 1500, "search": 400, "plantnet": 1200, "weather": 150, "yookassa": 300}
+SERVICES = tuple(LATENCY_MS)
+
+app = FastAPI()
+config = {"latency": dict(LATENCY_MS), "error_rate": 0.0, "jitter": 0.3, "photo_bytes": 150_000}
+stats = {s: {"requests": 0, "errors": 0} for s in SERVICES}
+telegram_log = []  # (время, метод, chat_id, первые символы текста)
+_message_ids = iter(range(1, 1 << 62))
+
+
+async def upstream(service):
+    """Задержка с разбросом ±jitter и решение, отвечать ли ошибкой."""
+    stats[service]["requests"] += 1
+    base = config["latency"][service] / 1000
+    await asyncio.sleep(max(0.0, random.uniform(base * (1 - config["jitter"]), base * (1 + config["jitter"]))))
+    if random.random() < config["error_rate"]:
+        stats[service]["errors"] += 1
+        return True
+    return False
+
+
+# ─── Telegram Bot API ───
+def _message(chat_id, text):
+    return {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": int(chat_id), "type": "private"},
+        "from": {"id": 1, "is_bot": True, "first_name": "bench"},
+        "text": text or "",
+    }
+
+
+@app.post("/telegram/bot{token}/{method}")
+async def telegram_method(token: str, method: str, request: Request):
+    # PTB шлёт параметры формой (значения — JSON-строки); python-multipart не тянем, разбираем сами
+    body = (await request.body()).decode()
+    if request.headers.get("content-type", "").startswith("application/json"):
+        form = json.loads(body or "{}")
+    else:
+        form = {k: v[0] for k, v in parse_qs(body).items()}
+    if await upstream("telegram"):
+        # Ошибка Telegram под нагрузкой — это 429 с retry_after
+        return JSONResponse(
+            {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1", "parameters": {"retry_after": 1}},
+            status_code=429,
+        )
+    chat_id = form.get("chat_id")
+    text = form.get("text")
+    if method in ("sendMessage", "editMessageText"):
+        telegram_log.append((time.time(), method, int(chat_id) if chat_id else 0, (text or "")[:16]))
+        return {"ok": True, "result": _message(chat_id or 0, text)}
+    if method == "getMe":
+        return {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}}
+    if method == "getFile":
+        file_id = form.get("file_id", "f")
+        return {"ok": True, "result": {
+            "file_id": file_id, "file_unique_id": file_id, "file_size": config["photo_bytes"],
+            "file_path": f"photos/{file_id}.jpg",
+        }}
+    # answerCallbackQuery, setWebhook, deleteWebhook и прочее — просто «ок»
+    return {"ok": True, "result": True}
+
+
+_photo_cache = {}
+
+
+def _photo(file_id):
+    """Настоящий JPEG (если есть Pillow — чтобы сработали dHash и уменьшение), разный для разных file_id."""
+    data = _photo_cache.get(file_id)
+    if data is None:
+        try:
+            from PIL import Image
+            rnd = random.Random(file_id)
+            img = Image.new("RGB", (1280, 960), (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)))
+            buf = io.BytesIO()
+            img.save(buf, "JPEG", quality=90)
+            data = buf.getvalue()
+        except ImportError:
+            data = b"\xff\xd8\xff\xe0" + random.Random(file_id).randbytes(config["photo_bytes"] - 4)
+        if len(_photo_cache) < 10000:
+            _photo_cache[file_id] = data
+    return data
+
+
+@app.get("/telegram/file/bot{token}/{path:path}")
+async def telegram_file(token: str, path: str):
+    if await upstream("telegram_file"):
+        return Response(status_code=502)
+    file_id = path.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+    return Response(_photo(file_id), media_type="image/jpeg")
+
+
+# ─── YandexGPT ───
+ANSWER = (
+    "1. Подготовьте почву: перекопайте и внесите перегной. "
+    "2. Сейте после прогрева почвы до +10 °C. "
+    "3. Поливайте умеренно тёплой водой, по утрам. "
+    "4. Через две недели подкормите комплексным удобрением. "
+    "5. Следите за листьями — пятна и скручивание говорят о болезни или вредителях."
+)
+
+
+def _gpt_result(text, final):
+    return {"result": {
+        "alternatives": [{"message": {"role": "assistant", "text": text},
+                          "status": "ALTERNATIVE_STATUS_FINAL" if final else "ALTERNATIVE_STATUS_PARTIAL"}],
+        "usage": {"inputTextTokens": "100", "completionTokens": str(len(text) // 4), "totalTokens": "300"},
+        "modelVersion": "bench",
+    }}
+
+
+@app.post("/yandexgpt/foundationModels/v1/completion")
+async def yandexgpt(request: Request):
+    body = await request.json()
+    stream = body.get("completionOptions", {}).get("stream")
+    if not stream:
+        if await upstream("gpt"):
+            return JSONResponse({"error": {"message": "internal"}}, status_code=500)
+        return _gpt_result(ANSWER, True)
+    # Потоковый режим: первая порция через ~1/5 задержки, дальше — равными долями
+    stats["gpt"]["requests"] += 1
+    if random.random() < config["error_rate"]:
+        stats["gpt"]["errors"] += 1
+        return JSONResponse({"error": {"message": "internal"}}, status_code=500)
+    total = config["latency"]["gpt"] / 1000
+    parts = 8
+
+    async def lines():
+        for i in range(1, parts + 1):
+            await asyncio.sleep(total / parts)
+            text = ANSWER[: len(ANSWER) * i // parts]
+            yield json.dumps(_gpt_result(text, i == parts), ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/json")
+
+
+# ─── Yandex Search ───
+@app.post("/search/v2/web/search")
+async def search(request: Request):
+    await request.body()
+    if await upstream("search"):
+        return JSONResponse({"error": "internal"}, status_code=500)
+    return {"items": [
+        {"title": f"Статья {i}", "url": f"https://example.org/{i}", "snippet": "Свежие рекомендации по посадке и уходу. " * 4}
+        for i in range(5)
+    ]}
+
+
+# ─── PlantNet ───
+@app.post("/plantnet/v2/identify/all")
+async def plantnet(request: Request):
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+    if await upstream("plantnet"):
+        return JSONResponse({"statusCode": 500, "error": "Internal"}, status_code=500)
+    return {"results": [{
+        "score": 0.87,
+        "species": {
+            "scientificNameWithoutAuthor": "Solanum lycopersicum",
+            "family": {"scientificNameWithoutAuthor": "Solanaceae"},
+            "commonNames": ["Томат", "Помидор"],
+        },
+    }], "bench_upload_bytes": size}
+
+
+# ─── OpenWeatherMap ───
+@app.get("/weather/data/2.5/forecast")
+async def weather(request: Request):
+    if await upstream("weather"):
+        return JSONResponse({"cod": "500", "message": "internal"}, status_code=500)
+    lat = float(request.query_params.get("lat", 55.75))
+    lon = float(request.query_params.get("lon", 37.62))
+    start = int(time.time()) // 10800 * 10800
+    items = []
+    for i in range(40):
+        dt = start + i * 10800
+        # Суточный ход температуры плюс сдвиг по широте — у разных регионов разная погода
+        temp = 12 - (lat - 50) * 0.6 + 7 * math.sin((dt % 86400) / 86400 * 6.283 - 1.8)
+        item = {
+            "dt": dt,
+            "dt_txt": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(dt)),
+            "main": {"temp": round(temp, 1), "temp_min": round(temp - 1.5, 1), "temp_max": round(temp + 1.5, 1)},
+            "weather": [{"description": "облачно с прояснениями"}],
+            "pop": 0.2,
+        }
+        # Восток (Приморье) — с ливнями, чтобы на стенде срабатывали предупреждения и шла их рассылка
+        if lon > 100:
+            item["rain"] = {"3h": 6.0}
+        elif i % 7 == 3:
+            item["rain"] = {"3h": 2.4}
+        items.append(item)
+    city = {"name": "bench", "timezone": round(lon / 15) * 3600}
+    return {"cod": "200", "cnt": len(items), "list": items, "city": city}
+
+
+# ─── ЮKassa ───
+@app.post("/yookassa/v3/payments")
+async def yookassa_create(request: Request):
+    body = await request.json()
+    if await upstream("yookassa"):
+        return JSONResponse({"type": "error", "code": "internal_server_error"}, status_code=500)
+    payment_id = str(uuid.uuid4())
+    return {
+        "id": payment_id,
+        "status": "pending",
+        "paid": False,
+        "amount": body.get("amount", {"value": "10.00", "currency": "RUB"}),
+        "confirmation": {"type": "redirect", "confirmation_url": f"https://yookassa.bench/pay/{payment_id}"},
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
+        "description": body.get("description", ""),
+        "metadata": body.get("metadata", {}),
+        "recipient": {"account_id": "bench", "gateway_id": "bench"},
+        "refundable": False,
+        "test": True,
+    }
+
+
+# ─── Служебное ───
+@app.get("/_stats")
+async def get_stats():
+    return {"services": stats, "telegram_messages": len(telegram_log)}
+
+
+@app.get("/_telegram_log")
+async def get_telegram_log(since: int = 0):
+    return {"next": len(telegram_log), "items": telegram_log[since:]}
+
+
+@app.post("/_reset")
+async def reset():
+    telegram_log.clear()
+    for s in stats.values():
+        s["requests"] = s["errors"] = 0
+    return {"ok": True}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушки внешних API для нагрузочного стенда")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", default="", help="service=ms через запятую, напр. gpt=800,plantnet=2000")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов с ошибкой (0..1)")
+    parser.add_argument("--jitter", type=float, default=0.3)
+    args = parser.parse_args()
+    for pair in filter(None, args.latency.split(",")):
+        name, ms = pair.split("=")
+        if name not in config["latency"]:
+            parser.error(f"неизвестный сервис {name}; есть: {', '.join(SERVICES)}")
+        config["latency"][name] = float(ms)
+    config["error_rate"] = args.error_rate
+    config["jitter"] = args.jitter
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,464 @@
+# bench/run.py — нагрузочный стенд: бот + заглушки внешних API на localhost, синтетические апдейты в /telegram_webhook
+#
+#   python bench/run.py --scenario 10k
+#   python bench/run.py --scenario storm-10k --latency telegram=80 --json result.json
+#   python bench/run.py --users 5000 --rate 200 --duration 30 --error-rate 0.02
+#
+# Бот запускается отдельным процессом (uvicorn bot:app), поэтому память и запись на диск
+# в отчёте — именно его. Перед запуском база засевается пользователями (и напоминаниями
+# для «шторма») через Repository.migrate_from_dict — тем же путём, что и перенос data.json.
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from repository import Repository  # noqa: E402
+
+SCENARIOS = {
+    # users — засеянные пользователи, rate — апдейтов/с, storm — напоминаний на один момент,
+    # drain — сколько ждать дообработки после подачи нагрузки (шторм в 10k при 25 сообщ/с идёт ~7 минут)
+    "1k": {"users": 1000, "rate": 20, "duration": 60, "storm": 0, "drain": 60},
+    "10k": {"users": 10000, "rate": 100, "duration": 60, "storm": 0, "drain": 120},
+    "100k": {"users": 100000, "rate": 300, "duration": 60, "storm": 0, "drain": 180},
+    "storm-1k": {"users": 1000, "rate": 0, "duration": 0, "storm": 1000, "drain": 120},
+    "storm-10k": {"users": 10000, "rate": 0, "duration": 0, "storm": 10000, "drain": 900},
+    "storm-mixed": {"users": 10000, "rate": 50, "duration": 120, "storm": 5000, "drain": 600},
+}
+
+# Доли типов апдейтов в потоке — примерно как в проде
+MIX = (
+    ("question", 0.40),
+    ("weather", 0.20),
+    ("photo", 0.15),
+    ("calendar", 0.10),
+    ("culture", 0.10),
+    ("start", 0.05),
+)
+QUESTIONS = (
+    "Когда сажать томаты на рассаду?",
+    "Почему желтеют листья у огурцов в теплице?",
+    "Чем подкормить клубнику весной?",
+    "Как обрезать малину осенью?",
+    "Что посадить после картофеля?",
+    "Как бороться с тлёй на смородине без химии?",
+)
+CULTURES = ("🍅 Томаты", "🥒 Огурцы", "🥔 Картофель", "🍓 Клубника", "🌹 Розы", "🍏 Яблоки")
+REGIONS = (
+    ("Москва", "Europe/Moscow", 55.75, 37.62),
+    ("Новосибирск", "Asia/Novosibirsk", 55.03, 82.92),
+    ("Екатеринбург", "Asia/Yekaterinburg", 56.84, 60.61),
+    ("Краснодар", "Europe/Moscow", 45.04, 38.98),
+    ("Калининград", "Europe/Kaliningrad", 54.71, 20.51),
+    ("Владивосток", "Asia/Vladivostok", 43.12, 131.89),
+)
+UID_BASE = 10_000_000
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def ms(value):
+    return None if value is None else round(value * 1000, 1)
+
+
+# ─── Засев базы ───
+def seed(db_file, users, premium_share, storm, storm_at):
+    """users пользователей с регионами и координатами; первым storm — напоминание на момент storm_at."""
+    rnd = random.Random(42)
+    data = {}
+    premium_until = (datetime.now() + timedelta(days=30)).isoformat()
+    for i in range(users):
+        region, tz, lat, lon = rnd.choice(REGIONS)
+        user = {"region": region, "tz": tz, "place": region, "lat": lat, "lon": lon}
+        if rnd.random() < premium_share:
+            user.update({"premium": True, "premium_until": premium_until})
+        if i % 3 == 0:
+            user["alerts"] = True  # предупреждения о погоде — по подписке; на стенде подписан каждый третий
+        if i < storm:
+            local = datetime.fromtimestamp(storm_at, ZoneInfo(tz)).replace(tzinfo=None)
+            user["reminders"] = [{"id": 1, "text": "Полить рассаду", "datetime": local.isoformat(), "sent": False}]
+        data[str(UID_BASE + i)] = user
+    repo = Repository(db_file)
+    try:
+        # due_at_fn получает регион, а не uid — пояс берём из справочника регионов выше
+        zones = {region: tz for region, tz, _, _ in REGIONS}
+        repo.migrate_from_dict(
+            data,
+            lambda region, local_iso: datetime.fromisoformat(local_iso).replace(tzinfo=ZoneInfo(zones[region])).timestamp(),
+            lambda until_iso: datetime.fromisoformat(until_iso).timestamp(),
+        )
+    finally:
+        repo.close()
+
+
+# ─── Синтетические апдейты ───
+class UpdateFactory:
+    def __init__(self, users, seed_value=1):
+        self.users = users
+        self.rnd = random.Random(seed_value)
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        kinds, weights = zip(*MIX)
+        self.kinds, self.weights = kinds, weights
+
+    def _message(self, uid, **fields):
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private", "first_name": "Bench"},
+            "from": {"id": uid, "is_bot": False, "first_name": "Bench", "language_code": "ru"},
+            **fields,
+        }
+
+    def _photo(self, uid):
+        # Часть фото — одни и те же (пересланные в чатах), остальные уникальные
+        unique = f"p{self.rnd.randrange(200)}" if self.rnd.random() < 0.3 else f"p{uid}-{next(self.message_ids)}"
+        sizes = [(90, 67), (320, 240), (800, 600), (1280, 960), (2560, 1920)]
+        return [
+            {"file_id": f"{unique}_{w}", "file_unique_id": f"{unique}_{w}", "width": w, "height": h, "file_size": w * h // 8}
+            for w, h in sizes
+        ]
+
+    def make(self):
+        uid = UID_BASE + self.rnd.randrange(self.users)
+        kind = self.rnd.choices(self.kinds, self.weights)[0]
+        if kind == "question":
+            message = self._message(uid, text=self.rnd.choice(QUESTIONS))
+        elif kind == "weather":
+            message = self._message(uid, text="🌦 Погода")
+        elif kind == "photo":
+            message = self._message(uid, photo=self._photo(uid))
+        elif kind == "calendar":
+            message = self._message(uid, text="📅 Календарь посадок")
+        elif kind == "culture":
+            message = self._message(uid, text=self.rnd.choice(CULTURES))
+        else:
+            message = self._message(uid, text="/start", entities=[{"type": "bot_command", "offset": 0, "length": 6}])
+        return kind, uid, {"update_id": next(self.update_ids), "message": message}
+
+
+# ─── Процессы ───
+async def wait_ready(client, url, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(url)).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} не ответил за {timeout:.0f} с")
+
+
+def proc_status(pid):
+    """RSS и пик RSS (МБ), записанные на диск байты процесса — из /proc (только Linux)."""
+    result = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    result[line.split(":")[0]] = round(int(line.split()[1]) / 1024, 1)
+        with open(f"/proc/{pid}/io") as f:
+            for line in f:
+                key, value = line.split(":")
+                if key in ("write_bytes", "wchar"):
+                    result[key] = int(value)
+    except OSError:
+        pass
+    return result
+
+
+def file_sizes(*paths):
+    total = 0
+    for path in paths:
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                total += os.path.getsize(path + suffix)
+            except OSError:
+                pass
+    return total
+
+
+# ─── Прогон ───
+async def drive(args, bot_url, fakes_url, bot_pid, storm_at, storm_uids):
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    async with httpx.AsyncClient(timeout=30, limits=limits) as client:
+        await client.post(f"{fakes_url}/_reset")
+        factory = UpdateFactory(args.users)
+        sent = []  # (kind, uid, отправлено, ack за, статус)
+        io_before = proc_status(bot_pid)
+        pending = set()
+
+        async def post(kind, uid, update):
+            started = time.time()
+            try:
+                r = await client.post(f"{bot_url}/telegram_webhook", json=update)
+                status = r.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            sent.append((kind, uid, started, time.time() - started, status))
+
+        started = time.time()
+        # Открытая модель нагрузки: апдейты уходят по расписанию, не дожидаясь ответов бота
+        if args.rate > 0:
+            interval = 1 / args.rate
+            for n in itertools.count():
+                at = started + n * interval
+                if at - started >= args.duration:
+                    break
+                delay = at - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                kind, uid, update = factory.make()
+                task = asyncio.create_task(post(kind, uid, update))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.wait(pending)
+        load_end = time.time()
+        # Дожидаемся, пока бот разберёт очередь и дошлёт напоминания
+        drain_deadline = time.time() + args.drain
+        while time.time() < drain_deadline:
+            health = (await client.get(f"{bot_url}/health")).json()
+            idle = not (health["updates"]["depth"] or health["updates"]["in_flight"] or health["outbound"]["queued"])
+            if idle and (not storm_uids or time.time() > storm_at):
+                log = (await client.get(f"{fakes_url}/_telegram_log")).json()["items"]
+                if len(storm_deliveries(log, storm_uids)) >= len(storm_uids):
+                    break
+            await asyncio.sleep(0.5)
+        finished = time.time()
+        io_after = proc_status(bot_pid)
+        health = (await client.get(f"{bot_url}/health")).json()
+        log = (await client.get(f"{fakes_url}/_telegram_log")).json()["items"]
+        fake_stats = (await client.get(f"{fakes_url}/_stats")).json()
+    return {
+        "sent": sent, "io_before": io_before, "io_after": io_after,
+        "started": started, "load_end": load_end, "finished": finished,
+        "health": health, "telegram_log": log, "fakes": fake_stats,
+    }
+
+
+def storm_deliveries(log, storm_uids):
+    """chat_id -> момент первой доставки напоминания."""
+    delivered = {}
+    for at, method, chat, text in log:
+        if method == "sendMessage" and chat in storm_uids and chat not in delivered and "Напоминание" in text:
+            delivered[chat] = at
+    return delivered
+
+
+def first_replies(sent, log):
+    """Время до первого сообщения бота в чат после апдейта (sendMessage или editMessageText)."""
+    by_chat = {}
+    for at, method, chat, _ in log:
+        by_chat.setdefault(chat, []).append(at)
+    for times in by_chat.values():
+        times.sort()
+    result = {}
+    cursor = {}
+    for kind, uid, started, _, status in sorted(sent, key=lambda item: item[2]):
+        if status != 200:
+            continue
+        times = by_chat.get(uid, [])
+        i = cursor.get(uid, 0)
+        while i < len(times) and times[i] < started:
+            i += 1
+        if i < len(times):
+            result.setdefault(kind, []).append(times[i] - started)
+            cursor[uid] = i + 1
+    return result
+
+
+def report(args, run, db_files, storm_at, storm_uids):
+    sent = run["sent"]
+    acks = [ack for _, _, _, ack, status in sent if status == 200]
+    statuses = {}
+    for *_, status in sent:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    replies = first_replies(sent, run["telegram_log"])
+    updates = run["health"]["updates"]
+    elapsed = run["finished"] - run["started"]
+    result = {
+        "scenario": args.scenario,
+        "users": args.users,
+        "target_rate": args.rate,
+        "duration_s": round(run["load_end"] - run["started"], 1),
+        "updates_sent": len(sent),
+        "webhook_status": statuses,
+        "webhook_ack_ms": {"p50": ms(percentile(acks, 50)), "p99": ms(percentile(acks, 99)), "max": ms(max(acks, default=None))},
+        "first_reply_ms": {
+            kind: {"n": len(v), "p50": ms(percentile(v, 50)), "p99": ms(percentile(v, 99))}
+            for kind, v in sorted(replies.items())
+        },
+        "startup_s": run["health"].get("startup"),
+        "throughput_updates_per_s": round(updates["processed"] / elapsed, 1) if elapsed else None,
+        "updates": updates,
+        "outbound": run["health"]["outbound"],
+        "memory_mb": {
+            "rss_end": run["io_after"].get("VmRSS"),
+            "rss_peak": run["io_after"].get("VmHWM"),
+        },
+        "writes": {
+            "disk_write_bytes": run["io_after"].get("write_bytes", 0) - run["io_before"].get("write_bytes", 0),
+            "write_syscall_bytes": run["io_after"].get("wchar", 0) - run["io_before"].get("wchar", 0),
+            "db_bytes": file_sizes(*db_files),
+        },
+        "upstreams": run["fakes"]["services"],
+    }
+    if storm_uids:
+        delivered = storm_deliveries(run["telegram_log"], storm_uids)
+        lags = [at - storm_at for at in delivered.values()]
+        span = max(delivered.values()) - min(delivered.values()) if len(delivered) > 1 else 0
+        result["reminder_storm"] = {
+            "scheduled": len(storm_uids),
+            "delivered": len(delivered),
+            "lag_ms": {"p50": ms(percentile(lags, 50)), "p99": ms(percentile(lags, 99)), "max": ms(max(lags, default=None))},
+            "send_rate_per_s": round(len(delivered) / span, 1) if span else None,
+        }
+    return result
+
+
+def print_report(result):
+    print(f"\n═══ {result['scenario'] or 'custom'}: {result['users']} пользователей, {result['target_rate']} апд/с ═══")
+    if result["startup_s"]:
+        print("старт, с: " + "  ".join(f"{phase}={sec}" for phase, sec in result["startup_s"].items()))
+    print(f"апдейтов отправлено: {result['updates_sent']}  статусы: {result['webhook_status']}")
+    ack = result["webhook_ack_ms"]
+    print(f"ответ webhook, мс:   p50={ack['p50']}  p99={ack['p99']}  max={ack['max']}")
+    for kind, r in result["first_reply_ms"].items():
+        print(f"первый ответ {kind:<9} n={r['n']:<6} p50={r['p50']}  p99={r['p99']}")
+    print(f"обработано апдейтов: {result['updates']['processed']} ({result['throughput_updates_per_s']}/с), "
+          f"ошибок {result['updates']['failed']}, отказов 503 {result['updates']['rejected']}, "
+          f"макс. очередь {result['updates']['max_depth']}")
+    print(f"исходящие: отправлено {result['outbound']['sent']}, 429 {result['outbound']['retry_after']}, "
+          f"ошибок {result['outbound']['failed']}")
+    print(f"память, МБ: RSS {result['memory_mb']['rss_end']}, пик {result['memory_mb']['rss_peak']}")
+    w = result["writes"]
+    print(f"запись: на диск {w['disk_write_bytes'] / 1e6:.1f} МБ, write() {w['write_syscall_bytes'] / 1e6:.1f} МБ, "
+          f"размер баз {w['db_bytes'] / 1e6:.1f} МБ")
+    storm = result.get("reminder_storm")
+    if storm:
+        lag = storm["lag_ms"]
+        print(f"шторм напоминаний: доставлено {storm['delivered']}/{storm['scheduled']}, "
+              f"опоздание p50={lag['p50']} p99={lag['p99']} max={lag['max']} мс, {storm['send_rate_per_s']} сообщ/с")
+    print("внешние API: " + ", ".join(f"{k} {v['requests']} ({v['errors']} ош.)" for k, v in result["upstreams"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный стенд бота")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--rate", type=float, help="апдейтов в секунду")
+    parser.add_argument("--duration", type=float, help="секунд подачи нагрузки")
+    parser.add_argument("--storm", type=int, help="сколько напоминаний на один момент")
+    parser.add_argument("--storm-delay", type=float, default=20.0, help="через сколько секунд после засева срабатывает шторм")
+    parser.add_argument("--premium-share", type=float, default=0.2)
+    parser.add_argument("--latency", default="", help="задержки заглушек: service=ms,... (см. bench/fakes.py)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--connections", type=int, default=200)
+    parser.add_argument("--drain", type=float, help="сколько ждать дообработки после нагрузки")
+    parser.add_argument("--workers", type=int, default=1, help="WEB_CONCURRENCY бота; память тогда считается только по главному процессу")
+    parser.add_argument("--keep", action="store_true", help="не удалять временный каталог с базами")
+    parser.add_argument("--json", help="сохранить отчёт в файл")
+    args = parser.parse_args()
+    preset = SCENARIOS.get(args.scenario, {"users": 1000, "rate": 20, "duration": 30, "storm": 0, "drain": 120})
+    for key, value in preset.items():
+        if getattr(args, key) is None:
+            setattr(args, key, value)
+    args.storm = min(args.storm, args.users)
+
+    workdir = tempfile.mkdtemp(prefix="agro-bench-")
+    db_file = os.path.join(workdir, "data.db")
+    cache_db = os.path.join(workdir, "cache.db")
+    fakes_port, bot_port = free_port(), free_port()
+    fakes_url = f"http://127.0.0.1:{fakes_port}"
+    bot_url = f"http://127.0.0.1:{bot_port}"
+
+    storm_at = time.time() + args.storm_delay
+    seeded = time.time()
+    seed(db_file, args.users, args.premium_share, args.storm, storm_at)
+    print(f"засеяно {args.users} пользователей за {time.time() - seeded:.1f} с ({workdir})")
+    storm_uids = {UID_BASE + i for i in range(args.storm)}
+
+    env = dict(
+        os.environ,
+        TELEGRAM_TOKEN="123456:bench",
+        YOOKASSA_SHOP_ID="bench", YOOKASSA_SECRET_KEY="bench",
+        YANDEX_API_KEY="bench", YANDEX_FOLDER_ID="bench", YANDEX_SEARCH_TOKEN="bench",
+        PLANTNET_API_KEY="bench", WEATHER_API_KEY="bench",
+        TELEGRAM_API_URL=f"{fakes_url}/telegram",
+        YANDEX_LLM_URL=f"{fakes_url}/yandexgpt",
+        YANDEX_SEARCH_URL=f"{fakes_url}/search",
+        PLANTNET_URL=f"{fakes_url}/plantnet",
+        WEATHER_URL=f"{fakes_url}/weather",
+        YOOKASSA_API_URL=f"{fakes_url}/yookassa/v3",
+        DB_FILE=db_file, CACHE_DB=cache_db,
+        WEB_CONCURRENCY=str(args.workers),
+        LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"),
+    )
+    env.pop("RENDER_EXTERNAL_HOSTNAME", None)
+    fakes = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "bench", "fakes.py"), "--port", str(fakes_port),
+         "--latency", args.latency, "--error-rate", str(args.error_rate)],
+        env=env,
+    )
+    bot = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "bot:app", "--host", "127.0.0.1", "--port", str(bot_port),
+         "--log-level", "warning", "--no-access-log", *(["--workers", str(args.workers)] if args.workers > 1 else [])],
+        cwd=workdir, env={**env, "PYTHONPATH": ROOT},
+    )
+    try:
+        async def run():
+            async with httpx.AsyncClient() as client:
+                await wait_ready(client, f"{fakes_url}/_stats")
+                boot = time.time()
+                await wait_ready(client, f"{bot_url}/health")
+                print(f"бот готов за {time.time() - boot:.1f} с")
+            if storm_uids and time.time() > storm_at:
+                print("внимание: бот поднялся позже срока шторма — увеличьте --storm-delay")
+            return await drive(args, bot_url, fakes_url, bot.pid, storm_at, storm_uids)
+
+        result = report(args, asyncio.run(run()), (db_file, cache_db), storm_at, storm_uids)
+    finally:
+        for proc in (bot, fakes):
+            proc.terminate()
+        for proc in (bot, fakes):
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
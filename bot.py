@@ -3,19 +3,41 @@
 # bot.py (или main.py) — полный код под FastAPI / ASGI
 import os
 import json
+import sys
 import time
-import threading
+BOOT_STARTED = time.monotonic()  # отсюда считаем время холодного старта
+import contextvars
+import hashlib
+import socket
 import uuid
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 import asyncio
+import logging
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import PlainTextResponse, HTMLResponse
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
+from telegram.error import BadRequest, Forbidden
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
-import requests
-from yookassa import Configuration, Payment
-from yookassa.domain.notification import WebhookNotification
-main_loop = asyncio.get_event_loop()
+import http_client
+from storage import load_legacy
+from repository import Repository
+from scheduler import TimerQueue
+import imaging
+import lunar
+from live_message import LiveMessage
+from update_queue import UpdateQueue, FULL
+from quota import QuotaEngine
+from sender import TelegramSender, TokenBucket, PRIORITY_PAYMENT, PRIORITY_REMINDER, PRIORITY_BROADCAST
+from forecast import Forecast, alert_text
+from cache import TTLCache, SingleFlight, PersistentCache, get_or_load
+from geo import RegionIndex, REGION_TTL, normalize_region, zone_for_offset, utc_offset_hours
+from gazetteer import Gazetteer, DEFAULT_PATH as GAZETTEER_PATH
+import logs
+import metrics
+from metrics import EXTERNAL_LATENCY, HANDLER_DURATION, SCHEDULER_LAG, STORAGE_WRITE, QUEUE_DEPTH, EVENTS, STARTUP_SECONDS
+logs.setup()
+log = logging.getLogger("agro")
 # ─── Переменные окружения ───
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 YOOKASSA_SHOP_ID = os.getenv("YOOKASSA_SHOP_ID")
@@ -25,6 +47,28 @@ YANDEX_FOLDER_ID = os.getenv("YANDEX_FOLDER_ID")
 YANDEX_SEARCH_TOKEN = os.getenv("YANDEX_SEARCH_TOKEN")
 PLANTNET_API_KEY = os.getenv("PLANTNET_API_KEY")
 WEATHER_API_KEY = os.getenv("WEATHER_API_KEY")
+# Адреса внешних API — переопределяются для стендов (bench/ поднимает локальные заглушки)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+YANDEX_LLM_URL = os.getenv("YANDEX_LLM_URL", "https://llm.api.cloud.yandex.net")
+YANDEX_SEARCH_URL = os.getenv("YANDEX_SEARCH_URL", "https://searchapi.api.cloud.yandex.net")
+PLANTNET_URL = os.getenv("PLANTNET_URL", "https://my-api.plantnet.org")
+WEATHER_URL = os.getenv("WEATHER_URL", "https://api.openweathermap.org")
+YOOKASSA_API_URL = os.getenv("YOOKASSA_API_URL")  # по умолчанию — адрес из SDK
+def web_workers() -> int:
+    """
+    Сколько процессов uvicorn обслуживают бота (см. README, «Несколько воркеров»):
+    явный --workers N из командной строки (дочерние процессы uvicorn получают её же),
+    иначе WEB_CONCURRENCY — из неё uvicorn сам берёт число воркеров по умолчанию.
+    """
+    argv = sys.argv
+    for i, arg in enumerate(argv):
+        if arg == "--workers" and i + 1 < len(argv):
+            return max(1, int(argv[i + 1]))
+        if arg.startswith("--workers="):
+            return max(1, int(arg.split("=", 1)[1]))
+    return max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+# Лимиты, заданные на бота (SEND_RATE), делятся между воркерами
+WEB_WORKERS = web_workers()
 required = {
     "TELEGRAM_TOKEN": TELEGRAM_TOKEN,
     "YOOKASSA_SHOP_ID": YOOKASSA_SHOP_ID,
@@ -37,10 +81,29 @@ required = {
 missing = [k for k, v in required.items() if not v]
 if missing:
     raise ValueError(f"Отсутствуют обязательные переменные: {', '.join(missing)}")
-Configuration.account_id = YOOKASSA_SHOP_ID
-Configuration.secret_key = YOOKASSA_SECRET_KEY
+# ─── ЮKassa: SDK (а с ним и requests) импортируется при первом платеже или в фоне после старта ───
+_yookassa = None
+def yookassa_sdk():
+    """(Payment, WebhookNotification) с настроенными ключами магазина."""
+    global _yookassa
+    if _yookassa is None:
+        from yookassa import Configuration, Payment
+        from yookassa.domain.notification import WebhookNotification
+        Configuration.account_id = YOOKASSA_SHOP_ID
+        Configuration.secret_key = YOOKASSA_SECRET_KEY
+        if YOOKASSA_API_URL:
+            Configuration.api_url = YOOKASSA_API_URL
+        _yookassa = (Payment, WebhookNotification)
+    return _yookassa
 # ─── FastAPI приложение ───
 app = FastAPI(title="Агроном-бот", description="Telegram бот для садоводов и огородников")
+# Холодный старт, секунды от начала импорта bot.py: импорт модуля, приём запросов, готовность воркеров, первый ответ
+BOOT = {"import": None, "serving": None, "ready": None, "first_response": None}
+def boot_mark(phase):
+    if BOOT[phase] is None:
+        BOOT[phase] = round(time.monotonic() - BOOT_STARTED, 3)
+        STARTUP_SECONDS.set(BOOT[phase], phase=phase)
+        log.info("Этап старта пройден", extra={"phase": phase, "seconds": BOOT[phase]})
 @app.get("/success")
 async def payment_success():
     html_content = """
@@ -56,10 +119,67 @@ async def payment_success():
     """
     return HTMLResponse(content=html_content, status_code=200)
 # ─── Telegram Application ───
-application = Application.builder().token(TELEGRAM_TOKEN).build()
+application = (
+    Application.builder()
+    .token(TELEGRAM_TOKEN)
+    .base_url(f"{TELEGRAM_API_URL}/bot")
+    .base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    .build()
+)
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "16"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+def update_type(update) -> str:
+    if update.callback_query:
+        return "callback"
+    message = update.message
+    if message is None:
+        return "other"
+    if message.photo:
+        return "photo"
+    if message.text and message.text.startswith("/"):
+        return "command"
+    return "text" if message.text else "other"
+# process_update сам ловит исключения обработчиков и отдаёт их в error handler — оттуда и узнаём о провале
+handler_errors = contextvars.ContextVar("handler_errors", default=None)
+async def on_handler_error(update, context: ContextTypes.DEFAULT_TYPE):
+    errors = handler_errors.get()
+    if errors is not None:
+        errors.append(context.error)
+    log.error("Ошибка обработчика апдейта", exc_info=context.error,
+              extra={"update_type": update_type(update) if isinstance(update, Update) else "other"})
+async def process_update_timed(update):
+    errors = []
+    handler_errors.set(errors)
+    started = time.perf_counter()
+    try:
+        await application.process_update(update)
+    finally:
+        HANDLER_DURATION.observe(
+            time.perf_counter() - started, update_type=update_type(update), outcome="error" if errors else "ok"
+        )
+update_queue = UpdateQueue(process_update_timed, concurrency=UPDATE_WORKERS, maxsize=UPDATE_QUEUE_SIZE)
+# Все исходящие не в ответ на апдейт — через очередь с лимитами Telegram (~30 сообщений/с на бота);
+# SEND_RATE — на бота целиком, каждый воркер берёт свою долю
+sender = TelegramSender(application.bot, rate=float(os.getenv("SEND_RATE", "25")) / WEB_WORKERS)
+send_tasks = set()
+def spawn_send(coro):
+    """Фоновая отправка: вызывающий (таймер, webhook) не ждёт, пока очередь дойдёт до сообщения."""
+    task = asyncio.create_task(coro)
+    send_tasks.add(task)
+    task.add_done_callback(send_tasks.discard)
+    return task
 # ─── ДАННЫЕ ───
-DATA_FILE = "data.json"
-user_data = {}
+DATA_FILE = "data.json"  # старый формат, только для миграции
+DB_FILE = os.getenv("DB_FILE", "data.db")
+CACHE_DB = os.getenv("CACHE_DB", "cache.db")
+repo = Repository(DB_FILE)
+# Несколько процессов (uvicorn --workers / WEB_CONCURRENCY, см. web_workers) делят одну базу DB_FILE
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+MULTI_WORKER = WEB_WORKERS > 1
+REMINDER_LEASE = 600
+REMINDER_POLL = 30  # как часто подбирать напоминания, созданные другими воркерами
+region_index = RegionIndex(PersistentCache(CACHE_DB, "regions", maxsize=50000, ttl=REGION_TTL))
+gazetteer = Gazetteer(os.getenv("GAZETTEER_FILE", GAZETTEER_PATH))
 FREE_LIMITS = {
     "photos": 2,
     "reminders": 1,
@@ -81,126 +201,181 @@ CATEGORIES = {
     "🌿 Другие культуры": []
 }
 ALL_CULTURES = [c for cats in CATEGORIES.values() for c in cats]
+CULTURE_GROUPS = {c: lunar.culture_group(cat, c) for cat, cats in CATEGORIES.items() for c in cats}
 # ─── Загрузка / сохранение ───
+def region_utc_offset(region: str) -> int:
+    """Грубое смещение от UTC (в часах) по тексту региона."""
+    region = (region or "").lower()
+    if any(word in region for word in ["новосибирск", "красноярск", "омск", "+7", "сибирь"]):
+        return 7
+    if any(word in region for word in ["владивосток", "хабаровск", "+10"]):
+        return 10
+    if any(word in region for word in ["екатеринбург", "самара", "+5", "урал"]):
+        return 5
+    if any(word in region for word in ["калининград", "+2"]):
+        return 2
+    return 3 # по умолчанию Москва / европейская часть
+def user_tz(user) -> str:
+    """IANA-пояс пользователя; для старых записей без tz — по грубому смещению."""
+    return user.tz or zone_for_offset(region_utc_offset(user.region or ""))
+def user_now(user) -> datetime:
+    """Текущее локальное время пользователя (naive, как даты в напоминаниях)."""
+    return datetime.now(ZoneInfo(user_tz(user))).replace(tzinfo=None)
+def reminder_due_at(tz_name: str, local: datetime) -> float:
+    """Локальное время напоминания → абсолютный момент UTC (unix time), с учётом летнего времени."""
+    return local.replace(tzinfo=ZoneInfo(tz_name)).timestamp()
 def load_data():
-    global user_data
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, "r", encoding="utf-8") as f:
-                user_data = json.load(f)
-            print("Данные загружены")
-        except Exception as e:
-            print(f"Ошибка загрузки: {e}")
-            user_data = {}
-    else:
-        user_data = {}
-def save_data():
+    """Однократная миграция data.json (+ журнал) в SQLite."""
+    if repo.is_migrated():
+        return
+    if not (os.path.exists(DATA_FILE) or os.path.exists(DATA_FILE + ".log")):
+        return
+    try:
+        legacy = load_legacy(DATA_FILE)
+        count = repo.migrate_from_dict(
+            legacy,
+            lambda region, local_iso: reminder_due_at(zone_for_offset(region_utc_offset(region)), datetime.fromisoformat(local_iso)),
+            lambda until_iso: datetime.fromisoformat(until_iso).timestamp()
+        )
+        log.info("Данные перенесены из data.json в SQLite", extra={"source": DATA_FILE, "db": DB_FILE, "users": count})
+    except Exception:
+        log.exception("Ошибка миграции")
+place_tasks = {}  # (uid, регион) -> фоновое определение места геокодером
+def resolve_user_place(uid, user):
+    """
+    Каноническое место и IANA-пояс: из справочника — сразу; иначе сразу грубый пояс по региону,
+    а место и точный пояс геокодер найдёт в фоне (он не чаще запроса в секунду — обработчик его не ждёт).
+    """
+    place = gazetteer.lookup(user.region)
+    if place:
+        user.place, user.lat, user.lon, user.tz = place["name"], place["lat"], place["lon"], place["tz"]
+        return
+    user.place = user.lat = user.lon = None
+    user.tz = zone_for_offset(region_utc_offset(user.region))
+    key = (uid, user.region)
+    if key not in place_tasks:
+        task = place_tasks[key] = asyncio.create_task(locate_user(uid, user.region))
+        task.add_done_callback(lambda _: place_tasks.pop(key, None))
+async def locate_user(uid, region):
     try:
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(user_data, f, ensure_ascii=False, indent=2)
-        print("Данные сохранены")
+        place = await region_index.resolve(region)
     except Exception as e:
-        print(f"Ошибка сохранения: {e}")
-load_data()
-# ─── Проверка лимитов ───
-def can_use_feature(uid: str, feature: str) -> tuple[bool, int]:
-    user = user_data.setdefault(uid, {})
-    if is_premium_active(uid):
-        return True, 999
-    today = date.today().isoformat()
-    key_last = f"{feature}_last_date"
-    key_count = f"{feature}_count"
-    last_date = user.get(key_last)
-    count = user.get(key_count, 0)
-    if last_date != today:
-        count = 0
-        user[key_last] = today
-        user[key_count] = 0
-    max_count = FREE_LIMITS.get(feature, 999)
-    if count >= max_count:
-        return False, 0
-    remaining = max_count - count - 1
-    return True, max(0, remaining)
-def use_feature(uid: str, feature: str):
-    if is_premium_active(uid):
+        log.warning("Не удалось определить регион", extra={"region": region, "error": repr(e)})
         return
-    user = user_data.setdefault(uid, {})
-    today = date.today().isoformat()
-    user[f"{feature}_last_date"] = today
-    user[f"{feature}_count"] = user.get(f"{feature}_count", 0) + 1
-    save_data()
+    if not place:
+        return
+    user = get_user(uid)
+    if user is None or user.region != region:
+        return  # регион успели сменить
+    user.place, user.lat, user.lon, user.tz = place["name"], place["lat"], place["lon"], place["tz"]
+    save_user(uid, user)
+def get_user(uid):
+    return repo.get_user(uid)
+def save_user(uid, user):
+    try:
+        with STORAGE_WRITE.time(op="save_user"):
+            repo.save_user(uid, user)
+    except Exception:
+        log.exception("Ошибка сохранения", extra={"uid": uid})
+# ─── Проверка лимитов ───
+quota = QuotaEngine(repo, FREE_LIMITS, shared=MULTI_WORKER)
+def user_day(user) -> str:
+    """Сегодняшняя дата по часам пользователя — лимиты обнуляются в его полночь."""
+    return sys.intern(user_now(user).date().isoformat())  # одна строка дня на все счётчики
+def can_use_feature(uid: str, user, feature: str) -> tuple[bool, int]:
+    """Только проверка, без списания."""
+    return quota.peek(uid, feature, user_day(user))
+def consume_feature(uid: str, user, feature: str) -> tuple[bool, int]:
+    """Проверка и списание одним шагом: одновременные запросы не проскочат лимит."""
+    return quota.try_consume(uid, feature, user_day(user))
 # ─── Премиум ───
 def is_premium_active(uid: str) -> bool:
-    user = user_data.get(uid, {})
-    if not user.get("premium", False):
-        return False
-    until_str = user.get("premium_until")
-    if not until_str:
-        return False
+    return quota.is_premium(uid)
+async def notify_premium_expired(uid_str, until_ts):
+    until = datetime.fromtimestamp(until_ts)
+    # ─── Улучшенное уведомление об окончании ───
+    expire_msg = (
+        "⚠️ <b>Премиум-доступ закончился</b>\n\n"
+        f"Срок действия истёк {until.strftime('%d.%m.%Y %H:%M')}.\n"
+        "Вернулись обычные лимиты:\n"
+        "• 2 фото для диагностики в день\n"
+        "• 5 вопросов агроному в день\n"
+        "• 1 напоминание\n\n"
+        "Хочешь вернуть безлимит? Нажми «💎 Премиум» в меню!"
+    )
     try:
-        until = datetime.fromisoformat(until_str)
-        return datetime.now() < until
-    except:
-        return False
-def premium_expiration_checker():
+        await sender.send(
+            int(uid_str),
+            expire_msg,
+            PRIORITY_BROADCAST,
+            parse_mode="HTML",
+            reply_markup=main_keyboard()
+        )
+    except Exception as e:
+        log.warning("Не удалось уведомить об окончании премиума", extra={"uid": uid_str, "error": repr(e)})
+# Истечение премиума — таймеры: заводятся при старте и при оплате, срабатывают точно в срок
+premium_queue = TimerQueue()  # uid -> until
+premium_wakeup = asyncio.Event()
+def schedule_premium_expiry(uid, until_ts):
+    premium_queue.schedule(uid, until_ts)
+    premium_wakeup.set()
+async def premium_expiration_checker():
+    for uid_str, until_ts in await asyncio.to_thread(repo.all_premium):
+        premium_queue.schedule(uid_str, until_ts)
+    log.info("Таймеры окончания премиума загружены", extra={"timers": len(premium_queue)})
+    last_poll = time.time()
     while True:
-        now = datetime.now()
-        changed = False
-        for uid_str, user in list(user_data.items()):
-            if user.get("premium", False):
-                until_str = user.get("premium_until")
-                if until_str:
-                    try:
-                        until = datetime.fromisoformat(until_str)
-                        if now >= until:
-                            user["premium"] = False
-                            user.pop("premium_until", None)
-                            changed = True
-                            save_data()  # Сохраняем после каждого изменения
-                           
-                            # ─── Улучшенное уведомление об окончании ───
-                            expire_msg = (
-                                "⚠️ <b>Премиум-доступ закончился</b>\n\n"
-                                f"Срок действия истёк {until.strftime('%d.%m.%Y %H:%M')}.\n"
-                                "Вернулись обычные лимиты:\n"
-                                "• 2 фото для диагностики в день\n"
-                                "• 5 вопросов агроному в день\n"
-                                "• 1 напоминание\n\n"
-                                "Хочешь вернуть безлимит? Нажми «💎 Премиум» в меню!"
-                            )
-                           
-                            asyncio.run_coroutine_threadsafe(
-                                application.bot.send_message(
-                                    int(uid_str),
-                                    expire_msg,
-                                    parse_mode="HTML",
-                                    reply_markup=main_keyboard()
-                                ),
-                                main_loop
-                            )
-                    except Exception:
-                        # на случай битой даты
-                        user["premium"] = False
-                        user.pop("premium_until", None)
-                        changed = True
-                        save_data()
-        if changed:
-            print("Обновлены статусы премиум-доступа")
-        time.sleep(300) # 5 минут
+        premium_wakeup.clear()
+        now = time.time()
+        if MULTI_WORKER and now - last_poll >= REMINDER_POLL:
+            # Оплаты, принятые другими воркерами, нашей очереди не видны
+            for uid_str, until_ts in repo.expired_premium(now):
+                premium_queue.schedule(uid_str, until_ts)
+            repo.forget_updates(now - 86400)  # Telegram не ретраит дольше суток
+            last_poll = now
+        due_items = premium_queue.pop_due_items(now)
+        due = [uid_str for uid_str, _ in due_items]
+        for _, due_at in due_items:
+            SCHEDULER_LAG.observe(now - due_at, timer="premium")
+        if due:
+            # Вся пачка — одной транзакцией; уведомляет тот воркер, чей DELETE сработал,
+            # продлённый за это время премиум не трогаем
+            batch = []
+            for uid_str in due:
+                until_ts = repo.premium_until(uid_str)
+                if until_ts is not None and until_ts > now:
+                    premium_queue.schedule(uid_str, until_ts)  # продлили в другом воркере
+                elif until_ts is not None:
+                    batch.append((uid_str, until_ts))
+            expired = quota.clear_premium_many(batch)
+            if expired:
+                log.info("Истёк премиум", extra={"users": len(expired)})
+                # Рассылка идёт темпом очереди отправки и не задерживает следующие пачки
+                for uid_str, until_ts in expired:
+                    spawn_send(notify_premium_expired(uid_str, until_ts))
+            continue
+        next_due = premium_queue.next_due()
+        timeout = None if next_due is None else max(0.0, next_due - now)
+        if MULTI_WORKER:
+            timeout = REMINDER_POLL if timeout is None else min(timeout, REMINDER_POLL)
+        try:
+            await asyncio.wait_for(premium_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
 # ─── YandexGPT ───
-def search_yandex_web(query: str, max_results: int = 5) -> str:
+async def search_yandex_web(query: str, max_results: int = 5) -> str:
     if not YANDEX_SEARCH_TOKEN:
-        print("[SEARCH] Ошибка: YANDEX_SEARCH_TOKEN отсутствует")
+        log.error("YANDEX_SEARCH_TOKEN отсутствует")
         return ""
     
     if not YANDEX_FOLDER_ID or YANDEX_FOLDER_ID.strip() == "":
-        print("[SEARCH] ОШИБКА: YANDEX_FOLDER_ID пустой!")
+        log.error("YANDEX_FOLDER_ID пустой")
         return ""
 
     folder_id = YANDEX_FOLDER_ID.strip()
-    print(f"[SEARCH] Запрос: {query[:70]}... | Folder_ID: '{folder_id}' (длина: {len(folder_id)})")
+    log.debug("Поиск", extra={"query": query[:70]})
 
-    url = "https://searchapi.api.cloud.yandex.net/v2/web/search"
+    url = f"{YANDEX_SEARCH_URL}/v2/web/search"
     
     headers = {
         "Authorization": f"Bearer {YANDEX_SEARCH_TOKEN}",
@@ -219,14 +394,12 @@ def search_yandex_web(query: str, max_results: int = 5) -> str:
     }
 
     try:
-        r = requests.post(url, headers=headers, json=payload, timeout=15)
-        
-        print(f"[SEARCH] Статус ответа: {r.status_code}")
+        r = await http_client.client("yandex_search").post(url, headers=headers, json=payload)
         
         if r.status_code == 200:
             data = r.json()
             items = data.get("items", [])
-            print(f"[SEARCH] Успешно! Найдено {len(items)} результатов")
+            log.debug("Поиск: результаты", extra={"items": len(items)})
             # ... (остальной код обработки результатов остаётся как был)
             if not items:
                 return ""
@@ -240,21 +413,104 @@ def search_yandex_web(query: str, max_results: int = 5) -> str:
             return "\n\n".join(lines) + "\n"
             
         else:
-            print(f"[SEARCH ERROR {r.status_code}]: {r.text[:800]}")
+            log.warning("Ошибка поиска", extra={"status": r.status_code, "body": r.text[:800]})
             return ""
             
     except Exception as e:
-        print(f"[SEARCH EXCEPTION] {type(e).__name__}: {e}")
+        log.warning("Ошибка поиска", extra={"error": repr(e)})
         return ""
 
 
-def ask_yandexgpt(region: str, question: str) -> str:
+# Кэш выдачи поиска по нормализованному запросу; пустой ответ (ошибка) держим недолго
+SEARCH_TTL = 6 * 3600
+SEARCH_BUDGET = float(os.getenv("SEARCH_BUDGET", "2.5"))
+search_cache = TTLCache(maxsize=4096, ttl=SEARCH_TTL)
+search_flight = SingleFlight()
+def search_ttl(results: str) -> float:
+    return SEARCH_TTL if results else 60
+
+
+# Кэш ответов агронома: одинаковые по смыслу вопросы из одного региона не идут в GPT повторно
+ANSWER_TTL = 3 * 86400
+FRESH_ANSWER_TTL = 15 * 60  # ответ по свежим данным (цены, прогноз, «сегодня») быстро устаревает
+answer_cache = PersistentCache(CACHE_DB, "gpt_answers", maxsize=20000, ttl=ANSWER_TTL)
+answer_flight = SingleFlight()
+QUESTION_STOPWORDS = {
+    "а", "и", "в", "во", "на", "у", "к", "по", "о", "об", "с", "со", "же", "ли", "бы", "ну", "мне", "меня", "мой", "моя",
+    "мои", "я", "вы", "ты", "пожалуйста", "подскажите", "подскажи", "скажите", "скажи", "это", "этот", "эти", "ещё", "еще",
+}
+def question_words(question: str):
+    text = question.lower().replace("ё", "е")
+    text = "".join(ch if ch.isalnum() else " " for ch in text)
+    return [w for w in text.split() if w not in QUESTION_STOPWORDS]
+def question_key(region: str, question: str) -> str | None:
+    """
+    Нормализованный ключ вопроса: без регистра и пунктуации, без слов-паразитов,
+    слова обрезаны до основы (5 букв), порядок слов сохранён —
+    «Когда сажать томаты?» и «подскажите, когда сажать томаты» дают один ключ.
+    """
+    stems = dict.fromkeys(w[:5] for w in question_words(question))
+    if not stems:
+        return None  # «а?», «👍» — не вопрос по сути; общий ключ на все такие сообщения региона не заводим
+    return normalize_region(region) + "|" + " ".join(stems)
+# Поиск нужен только там, где ответ зависит от свежих данных: цены, магазины, новинки, сроки «в этом году»
+FRESH_PREFIXES = ("цен", "стоим", "сколько стоит", "купи", "куплю", "магаз", "заказ", "новинк", "нов сорт",
+                  "прогноз", "сейчас", "сегодн", "завтра", "недел", "этом год", "закон", "запрет", "штраф",
+                  "субсид", "выставк", "ярмарк", "питомник")
+def needs_fresh_data(question: str) -> bool:
+    text = " ".join(question_words(question))
+    if any(w.isdigit() and len(w) == 4 and w.startswith("20") for w in text.split()):
+        return True
+    return any(text.startswith(p) or f" {p}" in text for p in FRESH_PREFIXES)
+async def ask_yandexgpt(region: str, question: str, search: bool = True, on_partial=None) -> str:
+    """
+    Ответ агронома. on_partial(text) — async-колбэк для частичного текста по мере генерации
+    (вызывается только у того, кто реально пошёл в GPT; остальные ждут общий ответ).
+    """
+    text, _ = await try_ask_yandexgpt(region, question, search, on_partial)
+    return text
+async def try_ask_yandexgpt(region: str, question: str, search: bool = True, on_partial=None):
+    """(текст, ok): при ошибке GPT ok=False, а текст — сообщение об ошибке для пользователя."""
+    key = question_key(region, question)
+    cached = answer_cache.get(key) if key else None
+    if cached is not None:
+        return cached, True
+    try:
+        if key is None:
+            return await _ask_yandexgpt(region, question, search, on_partial), True
+        return await answer_flight.do(key, lambda: _ask_yandexgpt_cached(key, region, question, search, on_partial)), True
+    except Exception as e:
+        log.warning("Ошибка YandexGPT", extra={"error": repr(e)})
+        return f"Ошибка ответа агронома: {str(e)}. Попробуй спросить проще.", False
+async def _ask_yandexgpt_cached(key, region, question, search, on_partial):
+    text = await _ask_yandexgpt(region, question, search, on_partial)
+    answer_cache.set(key, text, FRESH_ANSWER_TTL if needs_fresh_data(question) else ANSWER_TTL)
+    return text
+async def search_within_budget(question: str) -> str:
+    """
+    Результаты поиска, если они успели за SEARCH_BUDGET, иначе "" (отвечаем без поиска).
+    Запрос к поиску при этом не отменяется — его результат ляжет в кэш для следующих вопросов.
+    """
+    key = " ".join(sorted({w[:5] for w in question_words(question)}))
+    cached = search_cache.get(key)
+    if cached is not None:
+        return cached
+    task = asyncio.ensure_future(
+        get_or_load(search_cache, search_flight, key, lambda: search_yandex_web(question), search_ttl)
+    )
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), SEARCH_BUDGET)
+    except asyncio.TimeoutError:
+        EVENTS.inc(event="search_over_budget")
+        log.info("Поиск не уложился в бюджет — отвечаем без него", extra={"budget": SEARCH_BUDGET})
+        return ""
+async def _ask_yandexgpt(region: str, question: str, search: bool = True, on_partial=None) -> str:
     """
     Новый вариант: сначала поиск → если есть свежие данные → добавляем их в промпт.
-    Если поиска нет или он пустой → просто старый запрос к GPT.
+    Если поиск не нужен, не успел или пустой → просто старый запрос к GPT.
     """
-    # 1. Пробуем поиск
-    search_results = search_yandex_web(question)
+    # 1. Пробуем поиск — только для вопросов о свежих данных и в пределах бюджета времени
+    search_results = await search_within_budget(question) if search and needs_fresh_data(question) else ""
 
     system_prompt = (
         f"Ты агроном-консультант. Регион: {region}. "
@@ -273,140 +529,314 @@ def ask_yandexgpt(region: str, question: str) -> str:
     else:
         messages.append({"role": "user", "text": question})
 
-    try:
-        url = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
-        headers = {
-            "Authorization": f"Api-Key {YANDEX_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "modelUri": f"gpt://{YANDEX_FOLDER_ID}/yandexgpt-lite",
-            "completionOptions": {"stream": False, "temperature": 0.45, "maxTokens": 1400},
-            "messages": messages
-        }
+    url = f"{YANDEX_LLM_URL}/foundationModels/v1/completion"
+    headers = {
+        "Authorization": f"Api-Key {YANDEX_API_KEY}",
+        "Content-Type": "application/json"
+    }
+    data = {
+        "modelUri": f"gpt://{YANDEX_FOLDER_ID}/yandexgpt-lite",
+        "completionOptions": {"stream": on_partial is not None, "temperature": 0.45, "maxTokens": 1400},
+        "messages": messages
+    }
 
-        r = requests.post(url, headers=headers, json=data, timeout=18)
+    if on_partial is None:
+        r = await http_client.client("yandexgpt").post(url, headers=headers, json=data)
         r.raise_for_status()
         text = r.json()["result"]["alternatives"][0]["message"]["text"].strip()
+    else:
+        text = (await stream_yandexgpt(url, headers, data, on_partial)).strip()
 
-        # Добавляем метку, если использовался поиск
-        if search_results:
-            text += "\n\n(использованы свежие данные поиска Яндекса на март 2026)"
-
-        return text
+    # Добавляем метку, если использовался поиск
+    if search_results:
+        text += "\n\n(использованы свежие данные поиска Яндекса на март 2026)"
 
-    except Exception as e:
-        print(f"[GPT ERROR] {type(e).__name__}: {e}")
-        return f"Ошибка ответа агронома: {str(e)}. Попробуй спросить проще."
+    return text
+async def stream_yandexgpt(url, headers, data, on_partial):
+    """
+    Потоковый режим: ответ — строки JSON, в каждой весь текст, сгенерированный к этому моменту.
+    Ошибка колбэка (например, Telegram) не обрывает генерацию.
+    """
+    text = ""
+    async with http_client.client("yandexgpt").stream("POST", url, headers=headers, json=data) as r:
+        r.raise_for_status()
+        async for line in r.aiter_lines():
+            if not line.strip():
+                continue
+            text = json.loads(line)["result"]["alternatives"][0]["message"]["text"]
+            try:
+                await on_partial(text)
+            except Exception as e:
+                log.debug("Частичный ответ не показан", extra={"error": repr(e)})
+    return text
 # ─── Погода ───
-def get_week_weather(city):
+WEATHER_REFRESH = 3 * 3600  # OpenWeatherMap обновляет 5-дневный прогноз раз в 3 часа
+weather_cache = TTLCache(maxsize=20000)  # все кластеры пользователей: прогнозы обновляются заранее
+weather_flight = SingleFlight()
+def forecast_ttl(_=None) -> float:
+    """Живём до следующего 3-часового обновления прогноза (+10 минут на выкладку у источника)."""
+    now = time.time()
+    return WEATHER_REFRESH - now % WEATHER_REFRESH + 600
+class WeatherError(Exception):
+    pass
+async def fetch_forecast(city, lat=None, lon=None) -> Forecast:
+    url = f"{WEATHER_URL}/data/2.5/forecast"
+    params = {"appid": WEATHER_API_KEY, "units": "metric", "lang": "ru"}
+    if lat is not None and lon is not None:
+        params.update({"lat": lat, "lon": lon})
+    else:
+        params["q"] = city
+    resp = (await http_client.client("weather").get(url, params=params)).json()
+    if resp.get("cod") != "200":
+        raise WeatherError(resp.get("message"))
+    return Forecast(resp)
+async def fetch_week_weather(city, lat=None, lon=None):
+    return (await fetch_forecast(city, lat, lon)).render_week()
+def weather_key(city, lat=None, lon=None):
+    """(ключ кэша, lat, lon): по координатам (сетка 0.1° ≈ 10 км) соседние пункты попадают в один ключ."""
+    if lat is not None and lon is not None:
+        lat, lon = round(lat, 1), round(lon, 1)
+        return f"{lat},{lon}", lat, lon
+    return normalize_region(city), None, None
+async def get_week_weather(city, lat=None, lon=None):
+    key, lat, lon = weather_key(city, lat, lon)
     try:
-        url = f"https://api.openweathermap.org/data/2.5/forecast?q={city}&appid={WEATHER_API_KEY}&units=metric&lang=ru"
-        resp = requests.get(url, timeout=10).json()
-        if resp.get("cod") != "200":
-            return f"Ошибка погоды: {resp.get('message')}"
-        days = {}
-        for item in resp["list"]:
-            d = item["dt_txt"].split()[0]
-            temp = item["main"]["temp"]
-            desc = item["weather"][0]["description"]
-            days.setdefault(d, []).append((temp, desc))
-        lines = ["🌦 Прогноз на 5 дней:"]
-        for d, vals in list(days.items())[:5]:
-            avg = sum(v[0] for v in vals) / len(vals)
-            lines.append(f"{d}: {vals[0][1].capitalize()}, ≈{round(avg,1)}°C")
-        return "\n".join(lines)
+        return await get_or_load(weather_cache, weather_flight, key, lambda: fetch_week_weather(city, lat, lon), forecast_ttl)
+    except WeatherError as e:
+        return f"Ошибка погоды: {e}"
     except Exception as e:
         return f"Ошибка погоды: {str(e)}"
+# ─── Предупреждения о погоде ───
+WEATHER_FETCH_RATE = float(os.getenv("WEATHER_FETCH_RATE", "0.8"))  # бесплатный тариф OpenWeatherMap — 60 запросов в минуту
+ALERT_HOURS_LOCAL = range(8, 21)  # ночью не будим: предупреждение уйдёт со следующим прогоном
+ALERT_KEEP = 3 * 86400
+WEATHER_LEASE_SLACK = 900  # аренда переживает следующий прогон на 15 минут — соседи не перехватят её у живого воркера
+def alert_done(future):
+    if not future.cancelled() and future.exception() is not None:
+        log.debug("Предупреждение не доставлено", extra={"error": repr(future.exception())})
+async def refresh_forecasts():
+    """
+    Один прогон: прогноз один раз на кластер (ячейку 0.1° или регион без координат),
+    готовый текст — в weather_cache (кнопка «Погода» попадает в кэш), предупреждения — подписчикам кластера.
+    """
+    clusters = {}
+    labels = {}  # подпись кластера — каноническое название пункта из справочника, а не то, что ввёл пользователь
+    for uid, region, place, lat, lon, subscribed in await asyncio.to_thread(repo.forecast_targets):
+        key, lat, lon = weather_key(region, lat, lon)
+        cluster = clusters.get(key)
+        if cluster is None:
+            cluster = clusters[key] = (region, lat, lon, [])
+        if subscribed:
+            cluster[3].append(uid)
+        if place and key not in labels:
+            labels[key] = place
+    bucket = TokenBucket(WEATHER_FETCH_RATE, burst=5)
+    fetched = failed = alerted = 0
+    for key, (city, lat, lon, uids) in clusters.items():
+        delay = bucket.delay()
+        if delay:
+            await asyncio.sleep(delay)
+        bucket.take()
+        try:
+            forecast = await fetch_forecast(city, lat, lon)
+        except Exception as e:
+            failed += 1
+            log.warning("Прогноз не получен", extra={"cluster": key, "error": repr(e)})
+            continue
+        fetched += 1
+        weather_cache.set(key, forecast.render_week(), forecast_ttl())
+        now = time.time()
+        if not uids or forecast.local(now).hour not in ALERT_HOURS_LOCAL:
+            continue  # в кластере нет подписчиков — прогноз нужен только для кнопки «Погода»
+        for kind, day, value in forecast.alerts(now):
+            # Запись в базе: после перезапуска и из соседнего воркера то же предупреждение не уйдёт повторно
+            if not repo.claim_alert(f"{key}:{kind}:{day.isoformat()}", now):
+                continue
+            text = alert_text(kind, day, value, labels.get(key)) + "\n\nОтключить предупреждения: /alerts"
+            for uid in uids:
+                sender.submit(int(uid), text, PRIORITY_BROADCAST).add_done_callback(alert_done)
+            alerted += len(uids)
+            EVENTS.inc(len(uids), event=f"weather_alert_{kind}")
+    repo.forget_alerts(time.time() - ALERT_KEEP)
+    log.info("Прогнозы обновлены", extra={"clusters": len(clusters), "fetched": fetched, "failed": failed, "alerts": alerted})
+async def weather_alerts_checker():
+    while True:
+        # С несколькими воркерами прогнозы тянет один — у кого аренда; иначе лимит OpenWeatherMap делится на всех
+        if not MULTI_WORKER or await asyncio.to_thread(
+            repo.claim_lease, "weather_alerts", WORKER_ID, time.time(), forecast_ttl() + WEATHER_LEASE_SLACK
+        ):
+            await refresh_forecasts()
+        await asyncio.sleep(forecast_ttl())  # до следующей выкладки прогноза
 # ─── PlantNet ───
-async def analyze_plantnet(file_id, region):
+PLANTNET_MAX_BYTES = 5 * 1024 * 1024
+PLANTNET_MAX_SIDE = imaging.TARGET_SIDE * 3 // 2  # до такого размера фото уходит как есть
+TELEGRAM_DOWNLOAD_LIMIT = 20 * 1024 * 1024  # больше Bot API всё равно не отдаёт
+PHOTO_CHUNK = 64 * 1024
+class PhotoTooLarge(Exception):
+    pass
+class PlantNetError(Exception):
+    pass
+def telegram_file_url(file_obj):
+    path = file_obj.file_path
+    if path.startswith("http"):
+        return path
+    return f"{TELEGRAM_API_URL}/file/bot{TELEGRAM_TOKEN}/{path}"
+async def stream_telegram_file(url, limit):
+    """Куски файла из Telegram по мере скачивания; в памяти — не больше одного куска."""
+    received = 0
+    async with http_client.client("telegram_files").stream("GET", url) as resp:
+        resp.raise_for_status()
+        async for chunk in resp.aiter_raw(PHOTO_CHUNK):
+            received += len(chunk)
+            if received > limit:
+                raise PhotoTooLarge()
+            yield chunk
+async def buffer_chunks(data):
+    """Куски PHOTO_CHUNK из готового буфера — срезами memoryview, без копий."""
+    view = memoryview(data)
+    for start in range(0, len(view), PHOTO_CHUNK):
+        yield view[start:start + PHOTO_CHUNK]
+# Кэш распознавания: повторные и пересланные фото не идут ни в PlantNet, ни в GPT
+PLANT_ID_TTL = 30 * 86400
+plant_id_cache = PersistentCache(CACHE_DB, "plant_ids", maxsize=20000, ttl=PLANT_ID_TTL)
+plant_advice_cache = PersistentCache(CACHE_DB, "plant_advice", maxsize=20000, ttl=ANSWER_TTL)
+plant_flight = SingleFlight()
+def cached_species(keys):
+    for key in keys:
+        raw = plant_id_cache.get(key)
+        if raw:
+            return json.loads(raw)
+    return None
+async def download_photo(file_obj):
     """
-    Анализирует фотографию растения через PlantNet + YandexGPT.
+    Фото целиком (в пределах лимита Bot API) — нужно для хэшей до обращения к PlantNet.
+    Отдаётся сам bytearray: sha256, пул процессов и отправка в PlantNet принимают его без копии в bytes.
+    """
+    raw = bytearray()
+    async for chunk in stream_telegram_file(telegram_file_url(file_obj), TELEGRAM_DOWNLOAD_LIMIT):
+        raw += chunk
+    return raw
+async def identify_plant(photo):
+    """
+    Вид растения на фото: {sci_name, family, common_names, score} или None, если не распознано.
+    Ключи кэша: file_unique_id (без скачивания), sha256 байтов и перцептивный dHash (пересжатые копии;
+    у однотонных кадров хэш у всех одинаковый — по нему не кэшируем).
+    """
+    keys = [f"u:{photo.file_unique_id}"]
+    species = cached_species(keys)
+    if species:
+        return species
+    file_obj = await application.bot.get_file(photo.file_id)
+    size = file_obj.file_size
+    oversized = size is None or size > PLANTNET_MAX_BYTES or max(photo.width, photo.height) > PLANTNET_MAX_SIDE
+    log.debug("Обработка фото", extra={"width": photo.width, "height": photo.height, "size": size})
+    if oversized and not imaging.AVAILABLE and (size is None or size > PLANTNET_MAX_BYTES):
+        raise PhotoTooLarge()
+    data = await download_photo(file_obj)
+    keys.append("s:" + hashlib.sha256(data).hexdigest())
+    shrunk = None
+    if imaging.AVAILABLE:
+        # dHash и уменьшение — за одно декодирование в пуле процессов
+        fingerprint, shrunk = await imaging.prepare_async(data, shrink=oversized)
+        if imaging.distinctive(fingerprint):
+            keys.append(f"d:{fingerprint}")
+    species = cached_species(keys[1:])
+    if species is None:
+        if shrunk is not None:
+            log.debug("Фото уменьшено", extra={"from_bytes": len(data), "to_bytes": len(shrunk)})
+            data = shrunk
+        elif len(data) > PLANTNET_MAX_BYTES:
+            raise PhotoTooLarge()
+        species = await plant_flight.do(keys[1], lambda: _identify_plantnet(data))
+    if species:
+        raw = json.dumps(species, ensure_ascii=False)
+        for key in keys:
+            plant_id_cache.set(key, raw)
+    return species
+async def _identify_plantnet(data):
+    url = f"{PLANTNET_URL}/v2/identify/all"
+    params = {"api-key": PLANTNET_API_KEY, "lang": "ru"}
+    headers, body = http_client.multipart_file("images", "photo.jpg", "image/jpeg", buffer_chunks(data), len(data))
+    response = await http_client.client("plantnet").post(url, params=params, headers=headers, content=body)
+    if response.status_code != 200:
+        raise PlantNetError(f"Pl@ntNet вернул ошибку {response.status_code}: {response.text[:200]}")
+    result = response.json()
+    if "results" not in result or not result["results"]:
+        return None
+    best = result["results"][0]
+    species = best["species"]
+    return {
+        "sci_name": species.get("scientificNameWithoutAuthor", "—"),
+        "family": species.get("family", {}).get("scientificNameWithoutAuthor", "—"),
+        "common_names": species.get("commonNames", [])[:3],
+        "score": best["score"] * 100,
+    }
+async def plant_advice(species, region, on_partial=None):
+    """Советы GPT по виду и региону; одинаковые для всех фото этого вида в регионе."""
+    key = normalize_region(region) + "|" + species["sci_name"]
+    cached = plant_advice_cache.get(key)
+    if cached is not None:
+        return cached
+    prompt = (
+        f"Растение: {species['sci_name']} ({species['family']}). Вероятность {species['score']:.0f}%. "
+        f"Возможные болезни, вредители? Дай 2–3 совета по уходу в регионе {region}."
+    )
+    # Уход за видом — справочное знание, поиск тут только добавляет задержку
+    advice, ok = await try_ask_yandexgpt(region, prompt, search=False, on_partial=on_partial)
+    if ok:
+        plant_advice_cache.set(key, advice)
+    return advice
+async def analyze_plantnet(photo, region, live=None):
+    """
+    Анализирует фотографию растения (PhotoSize) через PlantNet + YandexGPT.
+    Крупное фото перед отправкой уменьшается в пуле процессов; повторы берутся из кэша.
+    live (LiveMessage) — показывать вид сразу, а советы по мере генерации.
     Возвращает текстовый результат или сообщение об ошибке.
     """
-    temp_path = f"temp_plant_{uuid.uuid4().hex[:8]}.jpg"
     try:
-        print(f"[PLANTNET] Начинаем обработку фото, file_id={file_id}, region={region}")
-        # 1. Получаем объект File из Telegram
-        file_obj = await application.bot.get_file(file_id)
-        print(f"[PLANTNET] Получен File объект, file_path={file_obj.file_path}")
-        # 2. Скачиваем фото в память (bytearray)
-        photo_bytes = await file_obj.download_as_bytearray()
-        print(f"[PLANTNET] Фото скачано, размер: {len(photo_bytes)} байт")
-        # Проверка размера фото
-        if len(photo_bytes) > 5 * 1024 * 1024:
-            return "Фото слишком большое (>5 МБ). Сожмите и пришлите снова."
-        # 3. Сохраняем на диск для отправки в PlantNet
-        with open(temp_path, "wb") as f:
-            f.write(photo_bytes)
-        print(f"[PLANTNET] Фото сохранено во временный файл: {temp_path}")
-        # 4. Отправляем в PlantNet API
-        url = "https://my-api.plantnet.org/v2/identify/all"
-        params = {"api-key": PLANTNET_API_KEY, "lang": "ru"}
-        with open(temp_path, 'rb') as img_file:
-            files = {'images': ('photo.jpg', img_file, 'image/jpeg')}
-            response = requests.post(url, files=files, params=params, timeout=30)
-        print(f"[PLANTNET] Ответ от API: status={response.status_code}")
-        if response.status_code != 200:
-            return f"Pl@ntNet вернул ошибку {response.status_code}: {response.text[:200]}"
-        data = response.json()
-        if "results" not in data or not data["results"]:
+        species = await identify_plant(photo)
+        if species is None:
             return "Растение не распознано. Попробуйте фото крупнее / чётче / с другого ракурса."
-        best = data["results"][0]
-        species = best["species"]
-        sci_name = species.get("scientificNameWithoutAuthor", "—")
-        family = species.get("family", {}).get("scientificNameWithoutAuthor", "—")
-        common_names = species.get("commonNames", [])
-        common_str = ", ".join(common_names[:3]) if common_names else "—"
-        score = best["score"] * 100
-        desc = f"**{sci_name}**\nСемейство: {family}\nНародные названия: {common_str}\nУверенность: {score:.1f}%"
-        # Запрос к YandexGPT с информацией о растении
-        prompt = (
-            f"Растение: {sci_name} ({family}). Вероятность {score:.0f}%. "
-            f"Возможные болезни, вредители? Дай 2–3 совета по уходу в регионе {region}."
+        common_str = ", ".join(species["common_names"]) if species["common_names"] else "—"
+        desc = (
+            f"**{species['sci_name']}**\nСемейство: {species['family']}\n"
+            f"Народные названия: {common_str}\nУверенность: {species['score']:.1f}%"
         )
-        gpt_advice = ask_yandexgpt(region, prompt)
+        on_partial = None
+        if live is not None:
+            await live.update(f"Анализ фото:\n{desc}\n\n⏳ Готовлю советы…")
+            on_partial = lambda text: live.update(f"Анализ фото:\n{desc}\n\n{text}")
+        gpt_advice = await plant_advice(species, region, on_partial)
         result = f"Анализ фото:\n{desc}\n\n{gpt_advice}"
         return result
+    except PhotoTooLarge:
+        return "Фото слишком большое (>5 МБ). Сожмите и пришлите снова."
+    except PlantNetError as e:
+        return str(e)
     except Exception as e:
         error_text = f"Ошибка анализа: {type(e).__name__}: {str(e)}"
-        print(f"[PLANTNET-ERROR] {error_text}")
+        log.exception("Ошибка анализа фото")
         return error_text + "\n\nПопробуйте отправить другое фото или повторить позже."
-    finally:
-        # Удаляем временный файл в любом случае
-        if os.path.exists(temp_path):
-            try:
-                os.remove(temp_path)
-                print(f"[PLANTNET] Временный файл удалён: {temp_path}")
-            except Exception as cleanup_e:
-                print(f"[PLANTNET-CLEANUP] Не удалось удалить {temp_path}: {cleanup_e}")
 # ─── Напоминания ───
+reminder_queue = TimerQueue()  # (uid, rem_id) -> due_at неотправленных напоминаний
+reminder_wakeup = asyncio.Event()
+def schedule_reminder(uid, rem_id, due_at):
+    reminder_queue.schedule((uid, rem_id), due_at)
+    reminder_wakeup.set()
+def unschedule_reminder(uid, rem_id):
+    reminder_queue.cancel((uid, rem_id))
 def get_user_reminders(uid):
-    return user_data.get(uid, {}).get("reminders", [])
-def save_reminder(uid, text, dt_iso):
-    user = user_data.setdefault(uid, {})
-    reminders = user.setdefault("reminders", [])
-    new_id = max([r.get("id", 0) for r in reminders], default=0) + 1
-    reminders.append({"id": new_id, "text": text.strip(), "datetime": dt_iso, "sent": False})
-    save_data()
+    return repo.list_reminders(uid)
+def save_reminder(uid, text, local, tz_name):
+    due_at = reminder_due_at(tz_name, local)
+    rem_id = repo.add_reminder(uid, text.strip(), local, due_at)
+    schedule_reminder(uid, rem_id, due_at)
+    return rem_id
 def delete_reminder(uid, rem_id):
-    user = user_data.get(uid, {})
-    if "reminders" not in user:
-        return False
-    old_len = len(user["reminders"])
-    user["reminders"] = [r for r in user["reminders"] if r.get("id") != rem_id]
-    if len(user["reminders"]) < old_len:
-        save_data()
-        return True
-    return False
+    unschedule_reminder(uid, rem_id)
+    return repo.delete_reminder(uid, rem_id)
 def mark_reminder_sent(uid, rem_id):
-    user = user_data.get(uid, {})
-    for r in user.get("reminders", []):
-        if r.get("id") == rem_id:
-            r["sent"] = True
-            save_data()
-            return True
-    return False
+    return repo.mark_reminder_sent(uid, rem_id)
 # ─── Клавиатуры ───
 def main_keyboard():
     keyboard = [
@@ -455,10 +885,14 @@ def submenu_keyboard(category):
         keyboard.append(row)
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 # ─── YooKassa webhook ───
+def payment_notice_done(future):
+    if not future.cancelled() and future.exception() is not None:
+        log.warning("Не удалось сообщить об оплате", extra={"error": repr(future.exception())})
 @app.post("/yookassa-webhook")
 async def yookassa_webhook(request: Request):
     try:
         event = await request.json()
+        _, WebhookNotification = yookassa_sdk()
         notification = WebhookNotification(event)
         if notification.event == "payment.succeeded":
             payment = notification.object
@@ -474,10 +908,8 @@ async def yookassa_webhook(request: Request):
                 now = datetime.now()
                 until = now + timedelta(days=days)
                
-                user = user_data.setdefault(str(uid), {})
-                user["premium"] = True
-                user["premium_until"] = until.isoformat()
-                save_data()
+                quota.set_premium(str(uid), until.timestamp())
+                schedule_premium_expiry(str(uid), until.timestamp())
                
                 success_msg = (
                     "🎉 <b>Оплата прошла успешно!</b>\n\n"
@@ -488,19 +920,17 @@ async def yookassa_webhook(request: Request):
                     "• безлимитные напоминания\n\n"
                     "Спасибо, что поддерживаешь проект 🌱"
                 )
-       
-        asyncio.run_coroutine_threadsafe(
-            application.bot.send_message(
-                uid,
-                success_msg,
-                parse_mode="HTML",
-                reply_markup=main_keyboard()
-            ),
-            main_loop
-        )
+                # Не ждём очередь отправки (она может стоять на паузе RetryAfter) — ЮKassa получит 200 сразу
+                sender.submit(
+                    uid,
+                    success_msg,
+                    PRIORITY_PAYMENT,
+                    parse_mode="HTML",
+                    reply_markup=main_keyboard()
+                ).add_done_callback(payment_notice_done)
         return PlainTextResponse("", status_code=200)
-    except Exception as e:
-        print(f"Webhook error: {e}")
+    except Exception:
+        log.exception("Ошибка webhook ЮKassa")
         return PlainTextResponse("", status_code=200)
 # ─── Telegram webhook ───
 @app.post("/telegram_webhook")
@@ -510,23 +940,42 @@ async def telegram_webhook(request: Request):
     try:
         update_dict = await request.json()
         update = Update.de_json(update_dict, application.bot)
-        await application.process_update(update)
-        return {}
     except Exception as e:
-        print(f"Ошибка process_update: {e}")
+        log.warning("Ошибка разбора апдейта", extra={"error": repr(e)})
         return {}
+    # Отвечаем Telegram сразу; обработка (GPT, PlantNet) идёт в воркерах очереди
+    chat = update.effective_chat or update.effective_user
+    if MULTI_WORKER and not update_queue.full() and not await asyncio.to_thread(repo.claim_update, update.update_id, time.time()):
+        return {}  # этот апдейт уже принял другой воркер
+    status = update_queue.submit(update.update_id, chat.id if chat else None, update)
+    if status == FULL:
+        # Очередь могла заполниться, пока шла отметка в базе: снимаем её, иначе повтор Telegram отбросим как дубль
+        if MULTI_WORKER:
+            await asyncio.to_thread(repo.unclaim_update, update.update_id)
+        # Telegram повторит доставку позже — это и есть обратное давление
+        raise HTTPException(status_code=503)
+    boot_mark("first_response")
+    return {}
 # ─── Health check ───
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 @app.get("/health")
 async def health_check():
-    return {"status": "OK"}
+    boot_mark("first_response")
+    return {
+        "status": "OK",
+        "ready": BOOT["ready"] is not None,
+        "startup": BOOT,
+        "updates": update_queue.stats(),
+        "outbound": sender.stats(),
+    }
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
-    if uid not in user_data:
-        user_data[uid] = {}
-    user = user_data[uid]
-    if "region" in user and user["region"].strip():
+    user = repo.ensure_user(uid)
+    if user.region and user.region.strip():
         await update.message.reply_text(
-            f"Рад вас снова видеть! Ваш регион: {user['region']}",
+            f"Рад вас снова видеть! Ваш регион: {user.region}",
             reply_markup=main_keyboard()
         )
     else:
@@ -534,37 +983,54 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "Привет! Я бот-агроном. Укажи свой регион для персонализированных советов.",
             reply_markup=ReplyKeyboardRemove()
         )
-        user["state"] = STATE_WAIT_REGION
-        save_data()
+        user.state = STATE_WAIT_REGION
+        save_user(uid, user)
+async def cmd_alerts(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    uid = str(update.effective_user.id)
+    user = repo.ensure_user(uid)
+    user.alerts = not user.alerts
+    save_user(uid, user)
+    if user.alerts:
+        text = "🔔 Предупреждения о заморозках, жаре и сильных осадках включены."
+    else:
+        text = "🔕 Предупреждения о погоде отключены. Включить снова: /alerts"
+    await update.message.reply_text(text, reply_markup=main_keyboard())
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
-    if uid not in user_data or "region" not in user_data[uid]:
+    user = get_user(uid)
+    if user is None or user.region is None:
         await update.message.reply_text("Сначала /start и укажи регион.")
         return
-    can_use, remaining = can_use_feature(uid, "photos")
+    can_use, remaining = consume_feature(uid, user, "photos")
     if not can_use:
         await update.message.reply_text("🚫 Лимит бесплатной диагностики исчерпан (2 фото).\nХотите без ограничений? Купите Премиум!")
         return
-    use_feature(uid, "photos")
-    photo = update.message.photo[-1].file_id
-    analysis = await analyze_plantnet(photo, user_data[uid].get("region", "Москва"))
-    await update.message.reply_text(analysis, reply_markup=main_keyboard())
+    # Не самый большой вариант, а ближайший к разрешению, которого хватает распознаванию
+    photo = imaging.pick_photo_size(update.message.photo)
+    live = await LiveMessage(update.message, "🔎 Распознаю растение…", reply_markup=main_keyboard()).start()
+    analysis = await analyze_plantnet(photo, user.region or "Москва", live)
+    await live.finish(analysis)
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
     text = update.message.text.strip() if update.message.text else ""
-    if uid not in user_data:
+    user = get_user(uid)
+    if user is None:
         await update.message.reply_text("Нажми /start")
         return
-    user = user_data[uid]
-    state = user.get("state")
+    if user.region and user.tz is None:
+        # Пользователи, указавшие регион до появления часовых поясов
+        resolve_user_place(uid, user)
+        save_user(uid, user)
+    state = user.state
     if state == STATE_WAIT_REGION:
         region = text.strip()
         if len(region) < 3:
             await update.message.reply_text("Название региона слишком короткое. Попробуйте ещё раз.")
             return
-        user["region"] = region
-        user.pop("state", None)
-        save_data()
+        user.region = region
+        resolve_user_place(uid, user)
+        user.state = None
+        save_user(uid, user)
         await update.message.reply_text(
             f"Отлично! Запомнил: **{region}** 🌍\nТеперь рекомендации будут учитывать ваш климат.\n\nЧто хотите сделать?",
             reply_markup=main_keyboard(),
@@ -575,10 +1041,10 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not text.strip():
             await update.message.reply_text("Текст не может быть пустым.")
             return
-        user["temp_rem_text"] = text.strip()
-        user["state"] = STATE_ADD_REM_DATE
+        user.temp_rem_text = text.strip()
+        user.state = STATE_ADD_REM_DATE
         await update.message.reply_text("Укажите дату: дд.мм.гггг\nПример: 15.03.2026")
-        save_data()
+        save_user(uid, user)
         return
     elif state == STATE_ADD_REM_DATE:
         try:
@@ -590,87 +1056,87 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             m = int(parts[1])
             y = int(parts[2])
             dt_date = datetime(y, m, d)
-            if dt_date < datetime.now().replace(hour=0, minute=0, second=0, microsecond=0):
+            if dt_date < user_now(user).replace(hour=0, minute=0, second=0, microsecond=0):
                 await update.message.reply_text("Дата должна быть в будущем.")
                 return
-            user["temp_rem_date"] = dt_date
-            user["state"] = STATE_ADD_REM_TIME
+            user.temp_rem_date = dt_date.toordinal()
+            user.state = STATE_ADD_REM_TIME
             await update.message.reply_text("Укажите время: чч:мм\nПример: 14:30")
-            save_data()
+            save_user(uid, user)
         except Exception as e:
-            print(f"[DATE-PARSE-ERROR] Ввод: {text!r} → {type(e).__name__}: {e}")
+            log.debug("Неверная дата", extra={"input": text, "error": repr(e)})
             await update.message.reply_text("Неверный формат даты. Ожидается: 15.03.2026\nПопробуйте ещё раз.")
         return
     elif state == STATE_ADD_REM_TIME:
         try:
             h, mm = map(int, text.replace(" ", "").split(":"))
-            dt = user["temp_rem_date"].replace(hour=h, minute=mm)
-            if dt < datetime.now():
+            dt = datetime.fromordinal(user.temp_rem_date).replace(hour=h, minute=mm)
+            if dt < user_now(user):
                 await update.message.reply_text("Дата+время должны быть в будущем.")
                 return
-            save_reminder(uid, user["temp_rem_text"], dt.isoformat())
-            can_use, _ = can_use_feature(uid, "reminders")
+            save_reminder(uid, user.temp_rem_text, dt, user_tz(user))
+            can_use, _ = can_use_feature(uid, user, "reminders")
             if not can_use and not is_premium_active(uid):
                 reminders = get_user_reminders(uid)
                 if reminders:
-                    delete_reminder(uid, max(r["id"] for r in reminders))
+                    delete_reminder(uid, max(r.id for r in reminders))
                 await update.message.reply_text("Лимит бесплатных напоминаний исчерпан.")
                 return
             if not is_premium_active(uid):
-                user["reminders_created"] = user.get("reminders_created", 0) + 1
-                save_data()
-            user.pop("state", None)
-            user.pop("temp_rem_text", None)
-            user.pop("temp_rem_date", None)
-            save_data()
+                user.reminders_created += 1
+                save_user(uid, user)
+            user.clear_dialog()
+            save_user(uid, user)
             await update.message.reply_text(
                 f"Напоминание создано на\n{dt.strftime('%d.%m.%Y %H:%M')}\n\n{text}",
                 reply_markup=main_keyboard()
             )
         except Exception as e:
-            print(f"[TIME-PARSE-ERROR] Ввод: {text!r} → {type(e).__name__}: {e}")
+            log.debug("Неверное время", extra={"input": text, "error": repr(e)})
             await update.message.reply_text("Неверный формат времени. Пример: 14:30")
         return
     elif state == STATE_EDIT_REM_VALUE:
-        rem_id = user.get("temp_rem_id")
-        field = user.get("edit_field")
-        reminder = next((r for r in get_user_reminders(uid) if r.get("id") == rem_id), None)
+        rem_id = user.temp_rem_id
+        field = user.edit_field
+        reminder = repo.get_reminder(uid, rem_id) if rem_id is not None else None
         if not reminder or not field:
             await update.message.reply_text("Ошибка. Попробуйте заново.")
-            user.pop("state", None)
-            save_data()
+            user.state = None
+            save_user(uid, user)
             return
-        dt = datetime.fromisoformat(reminder["datetime"])
+        dt = reminder.local
         try:
+            changes = {}
             if field == "text":
-                reminder["text"] = text.strip()
+                changes["text"] = text.strip()
             elif field == "date":
                 d, m, y = map(int, text.replace(" ", "").split("."))
                 new_dt = datetime(y, m, d, dt.hour, dt.minute)
-                if new_dt < datetime.now():
+                if new_dt < user_now(user):
                     await update.message.reply_text("Дата должна быть в будущем.")
                     return
-                reminder["datetime"] = new_dt.isoformat()
+                changes["local_dt"] = new_dt
             elif field == "time":
                 h, mm = map(int, text.replace(" ", "").split(":"))
                 new_dt = dt.replace(hour=h, minute=mm)
-                if new_dt < datetime.now():
+                if new_dt < user_now(user):
                     await update.message.reply_text("Время должно быть в будущем.")
                     return
-                reminder["datetime"] = new_dt.isoformat()
+                changes["local_dt"] = new_dt
             # Сбрасываем статус отправки при изменении даты/времени
-            if field in ("date", "time"):
-                reminder["sent"] = False
-            save_data()
+            if "local_dt" in changes:
+                changes["due_at"] = reminder_due_at(user_tz(user), changes["local_dt"])
+                changes["sent"] = 0
+            repo.update_reminder(uid, rem_id, **changes)
+            if "due_at" in changes:
+                schedule_reminder(uid, rem_id, changes["due_at"])
             await update.message.reply_text("Значение обновлено ✓", reply_markup=main_keyboard())
         except Exception as e:
-            print(f"[EDIT-ERROR] uid={uid}, rem_id={rem_id}, field={field}: {type(e).__name__}: {e}")
+            log.debug("Ошибка правки напоминания", extra={"uid": uid, "rem_id": rem_id, "field": field, "error": repr(e)})
             await update.message.reply_text(f"Ошибка формата: {str(e)}")
         finally:
-            user.pop("state", None)
-            user.pop("temp_rem_id", None)
-            user.pop("edit_field", None)
-            save_data()
+            user.clear_dialog()
+            save_user(uid, user)
         return
     elif state == STATE_WAIT_OTHER_CULTURE:
         culture = text.strip()
@@ -678,26 +1144,28 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("Название культуры не может быть пустым.")
             return
         year = datetime.now().year
-        region = user.get("region", "Москва")
-        can_use, remaining = can_use_feature(uid, "gpt_queries")
+        region = user.region or "Москва"
+        can_use, remaining = consume_feature(uid, user, "gpt_queries")
         if not can_use:
             await update.message.reply_text("🚫 Лимит бесплатных запросов к агроному исчерпан (5 шт).")
             return
-        use_feature(uid, "gpt_queries")
         prompt = (
             f"Для культуры '{culture}' в регионе {region} на {year} год: "
             "оптимальное время посадки/посева по лунному календарю, "
             "рекомендуемые сорта, актуальная информация на посевной сезон. "
             "Основывайся на свежих данных из интернета."
         )
-        answer = ask_yandexgpt(region, prompt)
-        await update.message.reply_text(answer, reply_markup=main_keyboard())
-        user.pop("state", None)
-        save_data()
+        live = await LiveMessage(update.message, reply_markup=main_keyboard()).start()
+        answer = await ask_yandexgpt(region, prompt, on_partial=live.update)
+        await live.finish(answer)
+        user.state = None
+        save_user(uid, user)
         return
     text_lower = text.lower()
     if text == "🌦 Погода":
-        answer = get_week_weather(user.get("region", "Moscow"))
+        answer = await get_week_weather(user.region or "Moscow", user.lat, user.lon)
+        if not user.alerts:
+            answer += "\n\n🔔 Предупреждать о заморозках, жаре и ливнях? Включить: /alerts"
         await update.message.reply_text(answer, reply_markup=main_keyboard())
         return
     elif text == "📸 Диагностика":
@@ -714,20 +1182,8 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     elif text == "📅 Календарь посадок":
-        year = datetime.now().year
-        region = user.get("region", "Москва")
-        can_use, remaining = can_use_feature(uid, "gpt_queries")
-        if not can_use:
-            await update.message.reply_text("🚫 Лимит бесплатных запросов к агроному исчерпан (5 шт).")
-            return
-        use_feature(uid, "gpt_queries")
-        prompt = (
-            f"Дай общий лунный посевной календарь на {year} год для России/СНГ, "
-            "с благоприятными днями по месяцам для вершков и корешков, "
-            "запрещёнными днями (новолуние, полнолуние). "
-            "Формат: **Месяц**: Благоприятные для вершков: ..., для корешков: ..., Запрещённые: ..."
-        )
-        calendar_text = ask_yandexgpt(region, prompt)
+        # Календарь считается локально (lunar.py) — без GPT и без расхода лимита
+        calendar_text = lunar.format_year_calendar(datetime.now().year, utc_offset_hours(user_tz(user)))
         await update.message.reply_text(
             calendar_text + "\n\nВыберите категорию культуры:",
             reply_markup=category_keyboard(),
@@ -736,12 +1192,12 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     elif text in CATEGORIES:
         if text == "Другие культуры":
-            user["state"] = STATE_WAIT_OTHER_CULTURE
+            user.state = STATE_WAIT_OTHER_CULTURE
             await update.message.reply_text(
                 "Напишите название интересующей вас культуры и я постараюсь найти о ней информацию",
                 reply_markup=ReplyKeyboardRemove()
             )
-            save_data()
+            save_user(uid, user)
             return
         else:
             await update.message.reply_text(
@@ -752,35 +1208,33 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif text in ALL_CULTURES:
         culture = text
         year = datetime.now().year
-        region = user.get("region", "Москва")
-        can_use, remaining = can_use_feature(uid, "gpt_queries")
+        region = user.region or "Москва"
+        await update.message.reply_text(
+            lunar.format_culture_calendar(culture, CULTURE_GROUPS[culture], user_now(user).date(), utc_offset=utc_offset_hours(user_tz(user))),
+            parse_mode="Markdown"
+        )
+        # Комментарий агронома (сорта, агротехника) — по желанию, в пределах лимита
+        can_use, remaining = consume_feature(uid, user, "gpt_queries")
         if not can_use:
-            await update.message.reply_text("🚫 Лимит бесплатных запросов к агроному исчерпан (5 шт).")
+            await update.message.reply_text(
+                "Советы агронома по сортам недоступны: лимит бесплатных запросов исчерпан (5 шт).",
+                reply_markup=main_keyboard()
+            )
             return
-        use_feature(uid, "gpt_queries")
         prompt = (
             f"Для культуры '{culture}' в регионе {region} на {year} год: "
-            "оптимальное время посадки/посева по лунному календарю, "
-            "рекомендуемые сорта, актуальная информация на посевной сезон. "
+            "рекомендуемые сорта, сроки посева/посадки с учётом климата, "
+            "актуальная информация на посевной сезон. "
             "Основывайся на свежих данных из интернета."
         )
-        answer = ask_yandexgpt(region, prompt)
-        await update.message.reply_text(answer, reply_markup=main_keyboard())
+        live = await LiveMessage(update.message, reply_markup=main_keyboard()).start()
+        answer = await ask_yandexgpt(region, prompt, on_partial=live.update)
+        await live.finish(answer)
         return
     elif any(kw in text_lower for kw in ["лунный", "календарь посадок", "лунный календарь"]):
-        year = datetime.now().year
-        region = user.get("region", "Москва")
-        can_use, remaining = can_use_feature(uid, "gpt_queries")
-        if not can_use:
-            await update.message.reply_text("🚫 Лимит бесплатных запросов к агроному исчерпан (5 шт).")
-            return
-        use_feature(uid, "gpt_queries")
-        prompt = (
-            f"Краткий лунный календарь посадок на {year} год для России/СНГ: "
-            "самые благоприятные дни по месяцам, запрещённые дни."
-        )
-        answer = ask_yandexgpt(region, prompt)
-        await update.message.reply_text(answer, reply_markup=main_keyboard())
+        now = user_now(user)
+        answer = lunar.format_year_calendar(now.year, utc_offset_hours(user_tz(user)), from_month=now.month)
+        await update.message.reply_text(answer, reply_markup=main_keyboard(), parse_mode="Markdown")
         return
     elif "что я умею" in text_lower or "умеешь" in text_lower:
         answer = (
@@ -796,42 +1250,38 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(answer, reply_markup=main_keyboard())
         return
     else:
-        can_use, remaining = can_use_feature(uid, "gpt_queries")
+        can_use, remaining = consume_feature(uid, user, "gpt_queries")
         if not can_use:
             await update.message.reply_text("🚫 Лимит бесплатных запросов к агроному исчерпан (5 шт).")
             return
-        use_feature(uid, "gpt_queries")
-        answer = ask_yandexgpt(user.get("region", "Moscow"), text)
-        await update.message.reply_text(answer, reply_markup=main_keyboard())
+        live = await LiveMessage(update.message, reply_markup=main_keyboard()).start()
+        answer = await ask_yandexgpt(user.region or "Moscow", text, on_partial=live.update)
+        await live.finish(answer)
 async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     uid = str(query.from_user.id)
-    user = user_data.setdefault(uid, {})
+    user = repo.ensure_user(uid)
     data = query.data
     if data == "rem_add":
-        user["state"] = STATE_ADD_REM_TEXT
-        user.pop("temp_rem_id", None)
+        user.state = STATE_ADD_REM_TEXT
+        user.temp_rem_id = None
         await query.edit_message_text(
             "Напишите текст напоминания:",
             reply_markup=InlineKeyboardMarkup.from_column([
                 InlineKeyboardButton("← Отмена", callback_data="rem_cancel")
             ])
         )
-        save_data()
+        save_user(uid, user)
     elif data == "rem_list":
         reminders = get_user_reminders(uid)
         if not reminders:
             text = "У вас пока нет напоминаний."
         else:
             lines = ["Ваши напоминания:"]
-            for r in sorted(reminders, key=lambda x: x.get("datetime", "9999-99-99T99:99:99")):
-                try:
-                    dt = datetime.fromisoformat(r["datetime"])
-                    status = "✅" if r.get("sent") else "⏳"
-                    lines.append(f"{status} #{r['id']} | {dt.strftime('%d.%m.%Y %H:%M')} | {r['text'][:40]}{'...' if len(r['text'])>40 else ''}")
-                except:
-                    lines.append(f"#{r['id']} | (ошибка даты) | {r['text'][:40]}...")
+            for r in sorted(reminders, key=lambda x: x.local_dt):
+                status = "✅" if r.sent else "⏳"
+                lines.append(f"{status} #{r.id} | {r.local.strftime('%d.%m.%Y %H:%M')} | {r.text[:40]}{'...' if len(r.text)>40 else ''}")
             text = "\n".join(lines)
         markup = InlineKeyboardMarkup.from_column([
             InlineKeyboardButton("← Назад", callback_data="rem_back")
@@ -843,13 +1293,9 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.answer("Нет напоминаний для редактирования", show_alert=True)
             return
         keyboard = []
-        for r in sorted(reminders, key=lambda x: x.get("datetime", "9999")):
-            try:
-                dt = datetime.fromisoformat(r["datetime"])
-                btn_text = f"#{r['id']} | {dt.strftime('%d.%m %H:%M')} | {r['text'][:25]}{'...' if len(r['text'])>25 else ''}"
-            except:
-                btn_text = f"#{r['id']} | (ошибка даты) | {r['text'][:25]}..."
-            keyboard.append([InlineKeyboardButton(btn_text, callback_data=f"edit_rem_{r['id']}")])
+        for r in sorted(reminders, key=lambda x: x.local_dt):
+            btn_text = f"#{r.id} | {r.local.strftime('%d.%m %H:%M')} | {r.text[:25]}{'...' if len(r.text)>25 else ''}"
+            keyboard.append([InlineKeyboardButton(btn_text, callback_data=f"edit_rem_{r.id}")])
         keyboard.append([InlineKeyboardButton("← Назад", callback_data="rem_back")])
         markup = InlineKeyboardMarkup(keyboard)
         await query.edit_message_text("Выберите напоминание:", reply_markup=markup)
@@ -859,20 +1305,16 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except:
             await query.answer("Некорректный ID", show_alert=True)
             return
-        reminder = next((r for r in get_user_reminders(uid) if r["id"] == rem_id), None)
+        reminder = repo.get_reminder(uid, rem_id)
         if not reminder:
             await query.answer("Напоминание не найдено", show_alert=True)
             return
-        user["temp_rem_id"] = rem_id
-        user["state"] = STATE_EDIT_REM_CHOOSE
-        try:
-            dt = datetime.fromisoformat(reminder["datetime"])
-            dt_str = dt.strftime('%d.%m.%Y %H:%M')
-        except:
-            dt_str = "(ошибка формата даты)"
+        user.temp_rem_id = rem_id
+        user.state = STATE_EDIT_REM_CHOOSE
+        dt_str = reminder.local.strftime('%d.%m.%Y %H:%M')
         text = (
             f"Напоминание #{rem_id}\n"
-            f"Текст: {reminder['text']}\n"
+            f"Текст: {reminder.text}\n"
             f"Дата и время: {dt_str}\n\n"
             "Что хотите изменить?"
         )
@@ -885,8 +1327,8 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except:
             await query.answer("Ошибка", show_alert=True)
             return
-        user["temp_rem_id"] = rem_id
-        user["edit_field"] = field
+        user.temp_rem_id = rem_id
+        user.edit_field = field
         prompts = {
             "text": "Введите новый текст напоминания:",
             "date": "Введите новую дату (дд.мм.гггг):",
@@ -898,8 +1340,8 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 InlineKeyboardButton("← Отмена", callback_data="rem_cancel_edit")
             ])
         )
-        user["state"] = STATE_EDIT_REM_VALUE
-        save_data()
+        user.state = STATE_EDIT_REM_VALUE
+        save_user(uid, user)
     elif data.startswith("del_rem_"):
         try:
             rem_id = int(data.split("_")[-1])
@@ -913,13 +1355,9 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 text = "У вас пока нет напоминаний."
             else:
                 lines = ["Ваши напоминания:"]
-                for r in sorted(reminders, key=lambda x: x.get("datetime", "9999-99-99T99:99:99")):
-                    try:
-                        dt = datetime.fromisoformat(r["datetime"])
-                        status = "✅" if r.get("sent") else "⏳"
-                        lines.append(f"{status} #{r['id']} | {dt.strftime('%d.%m.%Y %H:%M')} | {r['text'][:40]}{'...' if len(r['text'])>40 else ''}")
-                    except:
-                        lines.append(f"#{r['id']} | (ошибка даты) | {r['text'][:40]}...")
+                for r in sorted(reminders, key=lambda x: x.local_dt):
+                    status = "✅" if r.sent else "⏳"
+                    lines.append(f"{status} #{r.id} | {r.local.strftime('%d.%m.%Y %H:%M')} | {r.text[:40]}{'...' if len(r.text)>40 else ''}")
                 text = "\n".join(lines)
             markup = InlineKeyboardMarkup.from_column([
                 InlineKeyboardButton("← Назад", callback_data="rem_back")
@@ -928,9 +1366,8 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             await query.answer("Не удалось удалить", show_alert=True)
     elif data in ("rem_cancel", "rem_cancel_edit", "rem_back"):
-        for key in ["state", "temp_rem_id", "edit_field", "temp_rem_text", "temp_rem_date"]:
-            user.pop(key, None)
-        save_data()
+        user.clear_dialog()
+        save_user(uid, user)
         await query.edit_message_text(
             "Меню напоминаний",
             reply_markup=reminder_inline_keyboard()
@@ -938,8 +1375,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif data.startswith("premium_"):
         plan = data.split("_")[1]
        
-        # ДЕБАГ
-        print(f"[DEBUG-PREMIUM] Нажат тариф '{plan}' пользователем {uid}")
+        log.debug("Выбран тариф", extra={"plan": plan, "uid": uid})
         await query.answer(f"[ТЕСТ] Пытаемся создать платёж для {plan}...", show_alert=True)
        
         plans = {
@@ -950,35 +1386,36 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         }
        
         if plan not in plans:
-            print(f"[DEBUG-PREMIUM] Неизвестный план: {plan}")
+            log.warning("Неизвестный тариф", extra={"plan": plan})
             await query.answer("Неизвестный тариф", show_alert=True)
             return
        
         p = plans[plan]
        
         try:
-            print(f"[DEBUG-PREMIUM] Создаём платёж: {p['amount']} RUB, описание: {p['desc']}")
-           
             idempotency_key = str(uuid.uuid4())
-            payment = Payment.create({
-                "amount": {
-                    "value": p["amount"],
-                    "currency": "RUB"
-                },
-                "confirmation": {
-                    "type": "redirect",
-                    "return_url": "https://agro-bot-uxva.onrender.com/success" # упрощённый
-                },
-                "capture": True,
-                "description": p["desc"],
-                "metadata": {
-                    "user_id": uid,
-                    "plan": plan
-                }
-            }, idempotency_key)
+            Payment, _ = yookassa_sdk()
+            # SDK ЮKassa синхронный — уводим вызов в поток, чтобы не держать event loop
+            with EXTERNAL_LATENCY.time(upstream="yookassa"):
+                payment = await asyncio.to_thread(Payment.create, {
+                    "amount": {
+                        "value": p["amount"],
+                        "currency": "RUB"
+                    },
+                    "confirmation": {
+                        "type": "redirect",
+                        "return_url": "https://agro-bot-uxva.onrender.com/success" # упрощённый
+                    },
+                    "capture": True,
+                    "description": p["desc"],
+                    "metadata": {
+                        "user_id": uid,
+                        "plan": plan
+                    }
+                }, idempotency_key)
            
             payment_url = payment.confirmation.confirmation_url
-            print(f"[DEBUG-PREMIUM] Ссылка получена: {payment_url}")
+            log.info("Создан платёж", extra={"plan": plan, "uid": uid, "amount": p["amount"]})
            
             await query.message.reply_text(
                 f"Для активации премиум перейдите по ссылке:\n\n"
@@ -987,93 +1424,163 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             await query.answer("Ссылка на оплату создана")
         except Exception as e:
-            print(f"[ERROR-PREMIUM] Ошибка при создании платежа: {str(e)}")
-            import traceback
-            print(traceback.format_exc())
+            log.exception("Ошибка при создании платежа", extra={"plan": plan, "uid": uid})
             await query.answer(f"Ошибка создания платежа: {str(e)}", show_alert=True)
 # ─── Добавляем handlers ───
 application.add_handler(CommandHandler("start", cmd_start))
+application.add_handler(CommandHandler("alerts", cmd_alerts))
 application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
 application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
 application.add_handler(CallbackQueryHandler(callback_handler))
+application.add_error_handler(on_handler_error)
 # ─── Фоновые задачи ───
-def reminders_checker():
-    print("[НАПОМИНАНИЕ-ПРОВЕРКА] Фоновая задача запущена")
+async def deliver_reminder(uid_str, rem_id):
+    # Аренда в базе: из нескольких воркеров напоминание отправит ровно один.
+    # Берётся с запасом: в утренний пик сообщение может постоять в очереди отправки
+    if not repo.claim_reminder(uid_str, rem_id, WORKER_ID, time.time(), REMINDER_LEASE):
+        return
+    rem = repo.get_reminder(uid_str, rem_id)
+    if not rem:
+        return
+    try:
+        await sender.send(
+            int(uid_str),
+            f"🔔 Напоминание!\n{rem.text}",
+            PRIORITY_REMINDER,
+            reply_markup=main_keyboard()
+        )
+        SCHEDULER_LAG.observe(time.time() - rem.due_at, timer="reminder_delivered")
+        with STORAGE_WRITE.time(op="reminder_sent"):
+            mark_reminder_sent(uid_str, rem_id)
+    except (Forbidden, BadRequest) as e:
+        # Бот заблокирован или чат удалён — повтор не поможет, закрываем напоминание
+        log.warning("Напоминание не доставить", extra={"uid": uid_str, "rem_id": rem_id, "error": repr(e)})
+        mark_reminder_sent(uid_str, rem_id)
+    except Exception as e:
+        log.warning("Напоминание не отправлено", extra={"uid": uid_str, "rem_id": rem_id, "error": repr(e)})
+        # Повторим через минуту, как раньше при полном обходе; schedule_reminder будит спящий цикл
+        repo.release_reminder(uid_str, rem_id, WORKER_ID)
+        schedule_reminder(uid_str, rem_id, time.time() + 60)
+async def reminders_checker():
+    for uid_str, rem_id, due_at in await asyncio.to_thread(repo.pending_reminders):
+        reminder_queue.schedule((uid_str, rem_id), due_at)
+    log.info("Таймеры напоминаний загружены", extra={"timers": len(reminder_queue)})
+    last_poll = time.time()
     while True:
+        reminder_wakeup.clear()
+        now = time.time()
+        if MULTI_WORKER and now - last_poll >= REMINDER_POLL:
+            # Напоминания, созданные или перенесённые в других воркерах, нашей очереди не видны
+            for uid_str, rem_id, due_at in repo.due_reminders(now):
+                reminder_queue.schedule((uid_str, rem_id), due_at)
+            last_poll = now
+        due = reminder_queue.pop_due_items(now)
+        if due:
+            for (uid_str, rem_id), due_at in due:
+                SCHEDULER_LAG.observe(now - due_at, timer="reminder")
+                spawn_send(deliver_reminder(uid_str, rem_id))
+            continue
+        # Спим ровно до ближайшего срока; новое/изменённое напоминание будит раньше
+        next_due = reminder_queue.next_due()
+        timeout = None if next_due is None else max(0.0, next_due - now)
+        if MULTI_WORKER:
+            timeout = REMINDER_POLL if timeout is None else min(timeout, REMINDER_POLL)
         try:
-            server_now = datetime.now()
-            print(f"[НАПОМИНАНИЕ-ПРОВЕРКА] Проверка времени сервера: {server_now.isoformat()}")
-            changed = False
-            for uid_str, user in list(user_data.items()):
-                region = user.get("region", "").lower()
-                reminders = user.get("reminders", [])
-                if not reminders:
-                    continue
-                # Простое определение смещения (в часах) относительно UTC
-                offset_hours = 3 # по умолчанию Москва / европейская часть
-                if any(word in region for word in ["новосибирск", "красноярск", "омск", "+7", "сибирь"]):
-                    offset_hours = 7
-                elif any(word in region for word in ["владивосток", "хабаровск", "+10"]):
-                    offset_hours = 10
-                elif any(word in region for word in ["екатеринбург", "самара", "+5", "урал"]):
-                    offset_hours = 5
-                elif any(word in region for word in ["калининград", "+2"]):
-                    offset_hours = 2
-                # можно добавить ещё 2–3 популярных пояса по необходимости
-                user_local_now = server_now + timedelta(hours=offset_hours)
-                print(f"[НАПОМИНАНИЕ-ПРОВЕРКА] uid={uid_str}, регион='{region}', локальное время ~ {user_local_now.isoformat()}")
-                for rem in reminders:
-                    if rem.get("sent"):
-                        continue
-                    try:
-                        rem_time = datetime.fromisoformat(rem["datetime"])
-                        print(f"[НАПОМИНАНИЕ-ПРОВЕРКА] Проверяем напоминание {rem['id']}: {rem_time.isoformat()}")
-                        if rem_time <= user_local_now:
-                            print(f"[НАПОМИНАНИЕ-ПРОВЕРКА] Время пришло для uid={uid_str}! Отправляем: {rem['text']}")
-                            asyncio.run_coroutine_threadsafe(
-                                application.bot.send_message(
-                                    chat_id=int(uid_str),
-                                    text=f"🔔 Напоминание!\n{rem['text']}",
-                                    reply_markup=main_keyboard()
-                                ),
-                                main_loop
-                            ).result(timeout=8)
-                            mark_reminder_sent(uid_str, rem["id"])
-                            changed = True
-                    except Exception as e:
-                        print(f"[НАПОМИНАНИЕ-ПРОВЕРКА-ОШИБКА] uid={uid_str}, rem_id={rem.get('id')}: {type(e).__name__}: {e}")
-            if changed:
-                save_data()
-                print("[НАПОМИНАНИЕ-ПРОВЕРКА] Данные сохранены после отправки")
-        except Exception as outer_e:
-            print(f"[НАПОМИНАНИЕ-ПРОВЕРКА-КРИТИЧЕСКАЯ] {outer_e}")
-        time.sleep(60)
+            await asyncio.wait_for(reminder_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+background_tasks = []
+QUEUE_DEPTH.set_function(lambda: len(update_queue), queue="updates")
+QUEUE_DEPTH.set_function(lambda: update_queue.in_flight, queue="updates_in_flight")
+QUEUE_DEPTH.set_function(lambda: len(sender), queue="outbound")
+QUEUE_DEPTH.set_function(lambda: len(reminder_queue), queue="reminder_timers")
+QUEUE_DEPTH.set_function(lambda: len(premium_queue), queue="premium_timers")
+QUEUE_DEPTH.set_function(lambda: len(send_tasks), queue="pending_deliveries")
+async def supervise(name, job):
+    """Перезапускает упавшую фоновую задачу с экспоненциальной задержкой."""
+    delay = 1
+    while True:
+        started = time.monotonic()
+        try:
+            await job()
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            if time.monotonic() - started > 300:
+                delay = 1
+            log.exception("Фоновая задача упала", extra={"task": name, "restart_in": delay})
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 300)
 # ─── Lifespan (startup / shutdown) ───
-@app.on_event("startup")
-async def startup_event():
-    print("Starting Telegram Application...")
-    await application.initialize()
-    await application.start()
-    # Установка webhook автоматически
+async def set_webhook():
     domain = os.environ.get("RENDER_EXTERNAL_HOSTNAME")
-    if domain:
-        webhook_url = f"https://{domain}/telegram_webhook"
+    if not domain:
+        log.warning("RENDER_EXTERNAL_HOSTNAME не найден — webhook не установлен автоматически")
+        return
+    webhook_url = f"https://{domain}/telegram_webhook"
+    try:
+        await application.bot.set_webhook(url=webhook_url)
+        log.info("Webhook установлен", extra={"url": webhook_url})
+    except Exception as e:
+        log.error("Ошибка установки webhook", extra={"error": repr(e)})
+async def warm_up():
+    """
+    Всё, без чего можно ответить на /health и принять webhook: миграция, getMe, воркеры.
+    Апдейты, пришедшие раньше, ждут в update_queue и обрабатываются, как только воркеры запущены.
+    """
+    await asyncio.to_thread(load_data)
+    delay = 1
+    while True:
         try:
-            await application.bot.set_webhook(url=webhook_url)
-            print(f"Webhook успешно установлен: {webhook_url}")
+            await application.initialize()  # getMe — сетевой запрос к Telegram
+            break
         except Exception as e:
-            print(f"Ошибка установки webhook: {e}")
-    else:
-        print("RENDER_EXTERNAL_HOSTNAME не найден — webhook не установлен автоматически")
-    # Запуск фоновых задач
-    threading.Thread(target=reminders_checker, daemon=True).start()
-    print("[STARTUP] Запущена проверка напоминаний")
-    threading.Thread(target=premium_expiration_checker, daemon=True).start()
-    print("Фоновые проверки запущены")
+            log.error("Telegram недоступен при старте", extra={"error": repr(e), "retry_in": delay})
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+    await application.start()
+    update_queue.start()
+    sender.start()
+    background_tasks.append(asyncio.create_task(supervise("НАПОМИНАНИЯ", reminders_checker)))
+    background_tasks.append(asyncio.create_task(supervise("ПРЕМИУМ", premium_expiration_checker)))
+    background_tasks.append(asyncio.create_task(supervise("ЛИМИТЫ", quota.run_flusher)))
+    background_tasks.append(asyncio.create_task(supervise("ПОГОДА", weather_alerts_checker)))
+    boot_mark("ready")
+    log.info("Фоновые задачи запущены", extra={"update_workers": UPDATE_WORKERS, "update_queue": UPDATE_QUEUE_SIZE})
+    await set_webhook()
+    # Прогрев того, что иначе грузилось бы при первом запросе пользователя
+    await asyncio.to_thread(len, gazetteer)
+    await asyncio.to_thread(yookassa_sdk)
+@app.on_event("startup")
+async def startup_event():
+    # uvicorn принимает запросы только после startup — поэтому здесь ничего не ждём
+    log.info("Запуск Telegram Application")
+    background_tasks.append(asyncio.create_task(warm_up()))
+    boot_mark("serving")
 @app.on_event("shutdown")
 async def shutdown_event():
-    print("Остановка Telegram Application...")
-    await application.stop()
+    log.info("Остановка Telegram Application")
+    # Если воркеры так и не запустились, ждать дообработки некому — Telegram повторит доставку
+    await update_queue.stop(timeout=10 if BOOT["ready"] is not None else 0)
+    if send_tasks:
+        await asyncio.wait(send_tasks, timeout=10)  # даём уйти уже поставленным в очередь
+    await sender.stop()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    if application.running:
+        await application.stop()
     await application.shutdown()
-    print("Telegram Application остановлен")
-print("Приложение готово к запуску под uvicorn / FastAPI")
+    await http_client.aclose()
+    imaging.shutdown()
+    answer_cache.close()
+    plant_id_cache.close()
+    plant_advice_cache.close()
+    quota.flush()
+    repo.close()
+    log.info("Telegram Application остановлен")
+    logs.shutdown()
+boot_mark("import")
+log.info("Приложение готово к запуску под uvicorn / FastAPI")
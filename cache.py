@@ -0,0 +1,144 @@
+# cache.py — кэши в памяти: TTL + LRU и объединение одновременных запросов
+import asyncio
+import sqlite3
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """LRU-кэш ограниченного размера, у каждой записи свой срок жизни."""
+
+    def __init__(self, maxsize=1024, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at <= time.time():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl=None):
+        self._data[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+class SingleFlight:
+    """Одновременные промахи по одному ключу ждут один общий запрос к источнику."""
+
+    def __init__(self):
+        self._inflight = {}
+
+    def __len__(self):
+        return len(self._inflight)
+
+    async def do(self, key, factory):
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(factory())
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: отмена одного ожидающего не отменяет общий запрос для остальных
+        return await asyncio.shield(fut)
+
+
+async def get_or_load(cache, flight, key, loader, ttl=None):
+    """
+    Значение из cache или результат loader() (один на все одновременные промахи).
+    ttl может быть функцией от значения — для сроков, зависящих от ответа.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    async def load():
+        value = await loader()
+        cache.set(key, value, ttl(value) if callable(ttl) else ttl)
+        return value
+
+    return await flight.do(key, load)
+
+
+TOUCH_BATCH = 256  # столько попаданий копится до записи used_at
+
+
+class PersistentCache:
+    """
+    Кэш в SQLite-файле: переживает перезапуски.
+    Размер ограничен maxsize (вытесняются давно не читавшиеся записи), у записей TTL.
+    """
+
+    def __init__(self, path, table, maxsize=10000, ttl=86400.0):
+        self.table = table
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._writes = 0
+        self._touched = {}  # key -> время последнего чтения; пишется в базу пачкой, а не на каждое попадание
+        self.conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")  # файл кэша могут делить несколько воркеров
+        self.conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, used_at REAL NOT NULL)"
+        )
+        self.conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_used ON {table} (used_at)")
+        self.conn.commit()
+
+    def get(self, key, default=None):
+        now = time.time()
+        row = self.conn.execute(
+            f"SELECT value FROM {self.table} WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        if row is None:
+            return default
+        self._touched[key] = now
+        if len(self._touched) >= TOUCH_BATCH:
+            self.flush()
+        return row[0]
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, used_at) VALUES (?, ?, ?, ?)",
+                (key, value, now + (self.ttl if ttl is None else ttl), now)
+            )
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.evict()
+
+    def flush(self):
+        """Записывает накопленные used_at одной транзакцией."""
+        if not self._touched:
+            return
+        touched, self._touched = self._touched, {}
+        with self.conn:
+            self.conn.executemany(
+                f"UPDATE {self.table} SET used_at = ? WHERE key = ?", [(ts, key) for key, ts in touched.items()]
+            )
+
+    def evict(self):
+        self.flush()  # иначе вытеснение не увидит недавние чтения
+        with self.conn:
+            self.conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (time.time(),))
+            self.conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f"SELECT key FROM {self.table} ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.maxsize,)
+            )
+
+    def close(self):
+        self.flush()
+        self.conn.close()
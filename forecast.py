@@ -0,0 +1,95 @@
+# forecast.py — 5-дневный прогноз OpenWeatherMap столбцами: текст для кнопки «Погода» и агро-предупреждения
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+
+# Пороги предупреждений
+FROST_C = 0.0  # минимальная температура слота
+HEAT_C = 32.0  # максимальная температура слота
+HEAVY_RAIN_MM = 20.0  # осадки за местные сутки
+ALERT_HOURS = 48  # смотрим только ближайшие двое суток — дальше прогноз ненадёжен
+GROWING_MONTHS = range(4, 11)  # заморозки важны, пока в грунте рассада и урожай
+
+FROST, HEAT, RAIN = "frost", "heat", "rain"
+
+
+class Forecast:
+    """
+    Ответ /data/2.5/forecast (40 трёхчасовых слотов) в параллельных массивах:
+    правила считаются min/max/sum по срезам суток, без разбора словарей на каждый слот.
+    """
+
+    __slots__ = ("dt", "temp", "temp_min", "temp_max", "precip", "desc", "utc_dates", "utc_offset")
+
+    def __init__(self, resp):
+        items = resp["list"]
+        self.utc_offset = int(resp.get("city", {}).get("timezone", 0))  # секунды к UTC
+        self.dt = array("q", (i["dt"] for i in items))
+        self.temp = array("d", (i["main"]["temp"] for i in items))
+        self.temp_min = array("d", (i["main"].get("temp_min", i["main"]["temp"]) for i in items))
+        self.temp_max = array("d", (i["main"].get("temp_max", i["main"]["temp"]) for i in items))
+        self.precip = array("d", (i.get("rain", {}).get("3h", 0.0) + i.get("snow", {}).get("3h", 0.0) for i in items))
+        self.desc = [i["weather"][0]["description"] for i in items]
+        self.utc_dates = [i["dt_txt"].split()[0] for i in items]
+
+    def local(self, ts) -> datetime:
+        return datetime.fromtimestamp(ts + self.utc_offset, timezone.utc).replace(tzinfo=None)
+
+    def local_days(self, start, end):
+        """[(местная дата, lo, hi)] — срезы слотов с dt в [start, end), по местным суткам."""
+        lo, stop = bisect_left(self.dt, start), bisect_left(self.dt, end)
+        days = []
+        while lo < stop:
+            day = self.local(self.dt[lo]).date()
+            next_midnight = datetime.combine(day + timedelta(days=1), datetime.min.time())
+            boundary = int(next_midnight.replace(tzinfo=timezone.utc).timestamp()) - self.utc_offset
+            hi = min(bisect_left(self.dt, boundary, lo), stop)
+            days.append((day, lo, hi))
+            lo = hi
+        return days
+
+    def render_week(self) -> str:
+        """Текст для кнопки «🌦 Погода»: по дню на строку, средняя температура по слотам."""
+        lines = ["🌦 Прогноз на 5 дней:"]
+        days = {}
+        for i, d in enumerate(self.utc_dates):
+            days.setdefault(d, []).append(i)
+        for d, idx in list(days.items())[:5]:
+            avg = sum(self.temp[i] for i in idx) / len(idx)
+            lines.append(f"{d}: {self.desc[idx[0]].capitalize()}, ≈{round(avg, 1)}°C")
+        return "\n".join(lines)
+
+    def alerts(self, now):
+        """[(вид, местная дата, значение)] на ближайшие ALERT_HOURS — не больше одного предупреждения вида."""
+        found = {}
+        for day, lo, hi in self.local_days(now, now + ALERT_HOURS * 3600):
+            low = min(self.temp_min[lo:hi])
+            if FROST not in found and low <= FROST_C and day.month in GROWING_MONTHS:
+                found[FROST] = (FROST, day, low)
+            high = max(self.temp_max[lo:hi])
+            if HEAT not in found and high >= HEAT_C:
+                found[HEAT] = (HEAT, day, high)
+            rain = sum(self.precip[lo:hi])
+            if RAIN not in found and rain >= HEAVY_RAIN_MM:
+                found[RAIN] = (RAIN, day, rain)
+        return list(found.values())
+
+
+def alert_text(kind, day, value, place=None) -> str:
+    where = f" ({place})" if place else ""
+    when = day.strftime("%d.%m")
+    if kind == FROST:
+        return (
+            f"❄️ Заморозки{where}: до {value:+.0f}°C {when}.\n"
+            "Укройте рассаду и теплолюбивые культуры спанбондом, вечером полейте грядки — "
+            "влажная почва дольше держит тепло."
+        )
+    if kind == HEAT:
+        return (
+            f"🔥 Жара{where}: до {value:+.0f}°C {when}.\n"
+            "Поливайте рано утром или вечером, притените рассаду, замульчируйте грядки."
+        )
+    return (
+        f"🌧 Сильные осадки{where}: около {value:.0f} мм {when}.\n"
+        "Проверьте водоотвод, отложите подкормки и опрыскивания — их смоет."
+    )
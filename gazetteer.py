@@ -0,0 +1,150 @@
+# gazetteer.py — офлайн-справочник населённых пунктов: название → координаты и часовой пояс
+import bisect
+import logging
+import os
+from array import array
+
+from geo import normalize_region, CIS_COUNTRIES
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "gazetteer.tsv")
+
+# Слова, которые пользователи добавляют к названию и которые не помогают поиску
+ADMIN_WORDS = {
+    "область", "обл", "край", "республика", "респ", "район", "р-н", "округ", "автономный", "ао",
+    "поселок", "пос", "пгт", "село", "с", "деревня", "д", "станица", "ст", "снт", "дача", "россия", "рф",
+}
+# Падежные окончания и окончания прилагательных: «в Екатеринбурге», «новосибирская» — длинные первыми
+CASE_ENDINGS = ("ого", "ому", "ом", "ой", "ым", "ая", "ую", "ий", "ый", "ое", "ью", "е", "у", "а", "ы", "и")
+# Окончания именительного, которые возвращаем основе: «Москве» → «москв» → «москва», «Казани» → «казань»
+NOMINATIVE_ENDINGS = ("а", "ь", "я")
+GEONAMES_COUNTRIES = {c.upper() for c in CIS_COUNTRIES}
+log = logging.getLogger("agro.gazetteer")
+
+
+def _is_cyrillic(text: str) -> bool:
+    return any("а" <= ch <= "я" for ch in text.lower())
+
+
+class Gazetteer:
+    """
+    Справочник грузится при первом обращении. Записи — параллельные массивы
+    (array('f') для координат, индекс в списке поясов), ключи — отсортированный
+    список нормализованных названий для бинарного поиска по точному совпадению.
+    Формат файла: наш TSV (name, alternates, lat, lon, tz) или дамп GeoNames (cities*.txt).
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._loaded = False
+        self.names = []
+        self.lat = array("f")
+        self.lon = array("f")
+        self.zone_idx = array("H")
+        self.zones = []
+        self.keys = []
+        self.key_rec = array("I")
+        self.key_primary = bytearray()  # 1 — ключ из основного названия, 0 — из альтернативных
+
+    def __len__(self):
+        self._load()
+        return len(self.names)
+
+    def _add(self, name, alternates, lat, lon, tz, pending):
+        if tz not in self._zone_pos:
+            self._zone_pos[tz] = len(self.zones)
+            self.zones.append(tz)
+        rec = len(self.names)
+        self.names.append(name)
+        self.lat.append(lat)
+        self.lon.append(lon)
+        self.zone_idx.append(self._zone_pos[tz])
+        primary = normalize_region(name)
+        for key in {primary} | {normalize_region(a) for a in alternates}:
+            # При повторе ключа побеждает первая (более крупная) запись
+            if key and key not in pending:
+                pending[key] = (rec, key == primary)
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._zone_pos = {}
+        pending = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                rows = [line.rstrip("\n").split("\t") for line in f if line.strip() and not line.startswith("#")]
+            if rows and len(rows[0]) >= 18:
+                self._load_geonames(rows, pending)
+            else:
+                for name, alternates, lat, lon, tz in rows:
+                    self._add(name, [a for a in alternates.split(",") if a], float(lat), float(lon), tz, pending)
+        else:
+            log.warning("Файл справочника не найден — офлайн-поиск отключён", extra={"path": self.path})
+        self.keys = sorted(pending)
+        self.key_rec = array("I", (pending[k][0] for k in self.keys))
+        self.key_primary = bytearray(pending[k][1] for k in self.keys)
+        del self._zone_pos
+        self._loaded = True
+        log.info("Справочник загружен", extra={"places": len(self.names), "keys": len(self.keys)})
+
+    def _load_geonames(self, rows, pending):
+        # geonameid, name, asciiname, alternatenames, lat, lon, ..., country(8), ..., population(14), ..., timezone(17)
+        rows = [r for r in rows if r[8] in GEONAMES_COUNTRIES]
+        rows.sort(key=lambda r: -int(r[14] or 0))
+        for r in rows:
+            alternates = [a for a in r[3].split(",") if _is_cyrillic(a)]
+            name = alternates[0] if alternates and not _is_cyrillic(r[1]) else r[1]
+            self._add(name, alternates, float(r[4]), float(r[5]), r[17], pending)
+
+    def _record(self, rec):
+        return {
+            "name": self.names[rec],
+            "lat": round(self.lat[rec], 4),
+            "lon": round(self.lon[rec], 4),
+            "tz": self.zones[self.zone_idx[rec]],
+        }
+
+    def _exact(self, key, primary_only=False):
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key and (self.key_primary[i] or not primary_only):
+            return self.key_rec[i]
+        return None
+
+    def _candidates(self, region):
+        """Варианты ключа по убыванию специфичности: вся строка, части через запятую, пары слов, слова."""
+        parts = [region] + region.split(",")
+        seen = []
+        for part in parts:
+            words = [w for w in normalize_region(part).split() if w not in ADMIN_WORDS]
+            for cand in [" ".join(words)] + [" ".join(words[i:i + 2]) for i in range(len(words) - 1)] + words:
+                if cand and cand not in seen:
+                    seen.append(cand)
+        return seen
+
+    def lookup(self, region):
+        """
+        {name, lat, lon, tz} или None. Без сети, микросекунды на типичный запрос.
+        Только точные совпадения (с точностью до падежа): похожее название — другой город
+        («Красногорск» ≠ «Красноярск»), такие запросы уходят геокодеру.
+        """
+        self._load()
+        if not self.keys:
+            return None
+        candidates = self._candidates(region)
+        # Сначала названия пунктов («Миасс»), потом области/синонимы («челябинская»)
+        for primary_only in (True, False):
+            for cand in candidates:
+                rec = self._exact(cand, primary_only)
+                if rec is not None:
+                    return self._record(rec)
+        # «екатеринбурге», «новосибирская» → основа; «москве», «уфе», «казани» → основа + «а»/«ь»/«я»
+        for cand in candidates:
+            for ending in CASE_ENDINGS:
+                if not cand.endswith(ending):
+                    continue
+                stem = cand[:-len(ending)]
+                forms = ([stem] if len(stem) >= 4 else []) + ([stem + e for e in NOMINATIVE_ENDINGS] if len(stem) >= 2 else [])
+                for form in forms:
+                    rec = self._exact(form)
+                    if rec is not None:
+                        return self._record(rec)
+        return None
@@ -0,0 +1,108 @@
+# geo.py — регион пользователя → каноническое название, координаты и часовой пояс
+import asyncio
+import json
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from cache import SingleFlight
+
+REGION_TTL = 180 * 86400  # населённые пункты не переезжают: держим полгода
+NOMINATIM_INTERVAL = 1.0  # правила публичного Nominatim: не больше запроса в секунду
+CIS_COUNTRIES = ["ru", "by", "kz", "ua", "uz", "kg", "tj", "am", "az", "ge", "md", "tm"]
+
+# Представительные пояса для грубого смещения, если геокодер не ответил
+OFFSET_ZONES = {
+    2: "Europe/Kaliningrad",
+    3: "Europe/Moscow",
+    4: "Europe/Samara",
+    5: "Asia/Yekaterinburg",
+    6: "Asia/Omsk",
+    7: "Asia/Novosibirsk",
+    8: "Asia/Irkutsk",
+    9: "Asia/Yakutsk",
+    10: "Asia/Vladivostok",
+    11: "Asia/Magadan",
+    12: "Asia/Kamchatka",
+}
+
+
+def normalize_region(region: str) -> str:
+    """Ключ для региона: без регистра, пунктуации, «г.»/«город» и лишних пробелов."""
+    text = (region or "").lower().replace("ё", "е")
+    text = "".join(ch if ch.isalnum() or ch in " -" else " " for ch in text)
+    words = [w for w in text.split() if w not in ("г", "гор", "город")]
+    return " ".join(words)
+
+
+def zone_for_offset(offset_hours: int) -> str:
+    return OFFSET_ZONES.get(offset_hours, "Europe/Moscow")
+
+
+def utc_offset_hours(tz_name: str) -> int:
+    """Текущее смещение пояса от UTC в целых часах (с учётом летнего времени)."""
+    return int(datetime.now(ZoneInfo(tz_name)).utcoffset().total_seconds() // 3600)
+
+
+_geocoder = None
+_tzfinder = None
+
+
+def _geocode_sync(region: str):
+    # Тяжёлые библиотеки грузим только при первом реальном запросе
+    global _geocoder, _tzfinder
+    if _geocoder is None:
+        from geopy.geocoders import Nominatim
+        _geocoder = Nominatim(user_agent="agro-bot", timeout=5)
+    location = _geocoder.geocode(region, language="ru", country_codes=CIS_COUNTRIES)
+    if location is None:
+        return None
+    if _tzfinder is None:
+        from timezonefinder import TimezoneFinder
+        _tzfinder = TimezoneFinder(in_memory=True)
+    tz = _tzfinder.timezone_at(lng=location.longitude, lat=location.latitude)
+    if not tz:
+        return None
+    name = location.address.split(",")[0].strip()
+    return {"name": name, "lat": round(location.latitude, 4), "lon": round(location.longitude, 4), "tz": tz}
+
+
+_geocode_lock = asyncio.Lock()
+_geocode_last = 0.0
+
+
+async def geocode(region: str):
+    """
+    _geocode_sync в потоке, не чаще раза в NOMINATIM_INTERVAL на процесс (для любых регионов).
+    Очередь ждёт на блокировке в event loop, а не занимает потоки пула.
+    """
+    global _geocode_last
+    async with _geocode_lock:
+        wait = _geocode_last + NOMINATIM_INTERVAL - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        try:
+            return await asyncio.to_thread(_geocode_sync, region)
+        finally:
+            _geocode_last = time.monotonic()
+
+
+class RegionIndex:
+    """Постоянный индекс «регион → {name, lat, lon, tz}» поверх PersistentCache."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.flight = SingleFlight()
+
+    async def resolve(self, region: str):
+        """Из индекса или через геокодер (один запрос на одновременные промахи); None — не нашли."""
+        key = normalize_region(region)
+        if not key:
+            return None
+        raw = self.cache.get(key)
+        if raw:
+            return json.loads(raw)
+        place = await self.flight.do(key, lambda: geocode(region))
+        if place:
+            self.cache.set(key, json.dumps(place, ensure_ascii=False), REGION_TTL)
+        return place
@@ -0,0 +1,97 @@
+# http_client.py — общие асинхронные HTTP-клиенты для внешних API
+import time
+import uuid
+
+import httpx
+
+from metrics import EXTERNAL_LATENCY
+
+try:
+    import h2  # noqa: F401 — HTTP/2 включается, только если установлен httpx[http2]
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+# Свой пул keep-alive соединений и таймауты на каждый внешний сервис
+UPSTREAMS = {
+    "yandexgpt": {"timeout": httpx.Timeout(18.0, connect=5.0), "max_connections": 50},
+    "yandex_search": {"timeout": httpx.Timeout(8.0, connect=3.0), "max_connections": 20},
+    "plantnet": {"timeout": httpx.Timeout(30.0, connect=5.0), "max_connections": 20},
+    "weather": {"timeout": httpx.Timeout(10.0, connect=5.0), "max_connections": 20},
+    "telegram_files": {"timeout": httpx.Timeout(30.0, connect=5.0), "max_connections": 20},
+}
+
+_clients = {}
+
+
+class _TimedTransport(httpx.AsyncHTTPTransport):
+    """Время до заголовков ответа по каждому сервису; сетевые ошибки и 4xx/5xx — отдельным outcome."""
+
+    def __init__(self, upstream, **kwargs):
+        super().__init__(**kwargs)
+        self.upstream = upstream
+
+    async def handle_async_request(self, request):
+        started = time.perf_counter()
+        try:
+            response = await super().handle_async_request(request)
+        except Exception as e:
+            EXTERNAL_LATENCY.observe(time.perf_counter() - started, upstream=self.upstream, outcome=type(e).__name__)
+            raise
+        outcome = "ok" if response.status_code < 400 else f"http_{response.status_code // 100}xx"
+        EXTERNAL_LATENCY.observe(time.perf_counter() - started, upstream=self.upstream, outcome=outcome)
+        return response
+
+
+def client(name: str) -> httpx.AsyncClient:
+    """Клиент для сервиса name; создаётся при первом обращении и переиспользуется."""
+    c = _clients.get(name)
+    if c is None or c.is_closed:
+        cfg = UPSTREAMS[name]
+        c = httpx.AsyncClient(
+            timeout=cfg["timeout"],
+            transport=_TimedTransport(
+                name,
+                http2=HTTP2,
+                limits=httpx.Limits(
+                    max_connections=cfg["max_connections"],
+                    max_keepalive_connections=cfg["max_connections"],
+                    keepalive_expiry=60.0,
+                ),
+            ),
+        )
+        _clients[name] = c
+    return c
+
+
+async def aclose():
+    for c in list(_clients.values()):
+        await c.aclose()
+    _clients.clear()
+
+
+def multipart_file(field: str, filename: str, content_type: str, chunks, size: int):
+    """
+    Тело multipart/form-data с одним файлом, отдаваемое потоком: заголовки части,
+    затем куски файла как есть (bytes или срезы memoryview — без склейки и копирования), затем закрывающая граница.
+    Возвращает (headers, async-итератор тела); Content-Length известен заранее.
+    """
+    boundary = uuid.uuid4().hex
+    head = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode()
+    tail = f"\r\n--{boundary}--\r\n".encode()
+
+    async def body():
+        yield head
+        async for chunk in chunks:
+            yield chunk
+        yield tail
+
+    headers = {
+        "Content-Type": f"multipart/form-data; boundary={boundary}",
+        "Content-Length": str(len(head) + size + len(tail)),
+    }
+    return headers, body()
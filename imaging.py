@@ -0,0 +1,85 @@
+# imaging.py — подготовка фото перед распознаванием (уменьшение и пересжатие)
+import asyncio
+import io
+from concurrent.futures import ProcessPoolExecutor
+from importlib.util import find_spec
+
+# Сам Pillow импортируется в процессах пула при первом фото — не на старте бота
+AVAILABLE = find_spec("PIL") is not None
+
+# Распознаванию хватает ~1 Мп: больше пикселей — только дольше загрузка и ответ PlantNet
+TARGET_SIDE = 1280
+JPEG_QUALITY = 85
+MIN_HASH_BITS = 4
+
+_pool = None
+
+
+def pick_photo_size(sizes, target=TARGET_SIDE):
+    """Наименьший из PhotoSize, у которого длинная сторона не меньше target (иначе самый большой)."""
+    ordered = sorted(sizes, key=lambda p: p.width * p.height)
+    for p in ordered:
+        if max(p.width, p.height) >= target:
+            return p
+    return ordered[-1]
+
+
+def dhash(img, size: int = 8) -> str:
+    """
+    Перцептивный difference hash (64 бита, hex): яркость соседних пикселей уменьшенного
+    серого изображения. Не меняется при пересжатии и масштабировании — ловит пересланные копии.
+    """
+    from PIL import Image
+    small = img.convert("L").resize((size + 1, size), Image.BILINEAR)
+    px = small.load()
+    bits = 0
+    for y in range(size):
+        for x in range(size):
+            bits = (bits << 1) | (px[x, y] > px[x + 1, y])
+    return f"{bits:0{size * size // 4}x}"
+
+
+def distinctive(fingerprint: str) -> bool:
+    """
+    False для хэша почти однотонного кадра (все биты 0 или все 1 с точностью до MIN_HASH_BITS):
+    такой же хэш дают любые гладкие, пересвеченные или тёмные фото — как ключ кэша он не годится.
+    """
+    ones = bin(int(fingerprint, 16)).count("1")
+    return MIN_HASH_BITS <= ones <= len(fingerprint) * 4 - MIN_HASH_BITS
+
+
+def prepare(data: bytes, target: int = TARGET_SIDE, shrink: bool = False):
+    """(dhash, уменьшенный JPEG или None) за одно декодирование. Выполняется в отдельном процессе."""
+    from PIL import Image, ImageOps
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+        fingerprint = dhash(img)
+        out = None
+        if shrink:
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            img.thumbnail((target, target), Image.LANCZOS)
+            buf = io.BytesIO()
+            img.save(buf, "JPEG", quality=JPEG_QUALITY, optimize=True)
+            out = buf.getvalue()
+    return fingerprint, out
+
+
+async def _run(fn, *args):
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=2)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pool, fn, *args)
+
+
+async def prepare_async(data, shrink: bool = False, target: int = TARGET_SIDE):
+    """prepare в пуле процессов; data — bytes или bytearray (передаётся как есть, без копии)."""
+    return await _run(prepare, data, target, shrink)
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
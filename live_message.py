@@ -0,0 +1,64 @@
+# live_message.py — ответ, который дописывается на глазах: сообщение-заготовка + редкие правки
+import asyncio
+import time
+
+from telegram.error import BadRequest, RetryAfter
+
+TELEGRAM_TEXT_LIMIT = 4096
+EDIT_INTERVAL = 1.5  # Telegram терпит около одной правки сообщения в секунду на чат
+
+
+class LiveMessage:
+    """
+    Сначала сразу отправляет заготовку, затем показывает частичный текст правками
+    не чаще EDIT_INTERVAL; финальный текст применяется всегда.
+    """
+
+    def __init__(self, reply_to, placeholder="⏳ Думаю…", reply_markup=None, interval=EDIT_INTERVAL):
+        self.reply_to = reply_to
+        self.placeholder = placeholder
+        self.reply_markup = reply_markup
+        self.interval = interval
+        self.message = None
+        self._shown = ""
+        self._edited_at = 0.0
+
+    async def start(self):
+        self.message = await self.reply_to.reply_text(self.placeholder, reply_markup=self.reply_markup)
+        self._shown = self.placeholder
+        self._edited_at = time.monotonic()
+        return self
+
+    async def update(self, text: str):
+        """Частичный текст; лишние правки между интервалами просто пропускаются."""
+        if time.monotonic() - self._edited_at < self.interval:
+            return
+        await self._edit(text + " ▌")
+
+    async def finish(self, text: str, **kwargs):
+        if len(text) > TELEGRAM_TEXT_LIMIT:
+            # Длинный ответ: первая часть — в это сообщение, остальное отдельными
+            await self._edit(text[:TELEGRAM_TEXT_LIMIT], force=True, **kwargs)
+            for i in range(TELEGRAM_TEXT_LIMIT, len(text), TELEGRAM_TEXT_LIMIT):
+                await self.reply_to.reply_text(text[i:i + TELEGRAM_TEXT_LIMIT])
+            return
+        await self._edit(text, force=True, **kwargs)
+
+    async def _edit(self, text: str, force=False, **kwargs):
+        text = text[:TELEGRAM_TEXT_LIMIT]
+        if text == self._shown:
+            return
+        try:
+            await self.message.edit_text(text, **kwargs)
+            self._shown = text
+        except RetryAfter as e:
+            if not force:
+                self._edited_at = time.monotonic() + e.retry_after
+                return
+            await asyncio.sleep(e.retry_after)
+            await self.message.edit_text(text, **kwargs)
+            self._shown = text
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        self._edited_at = time.monotonic()
@@ -0,0 +1,76 @@
+# logs.py — структурированные логи: JSON-строка на событие, запись в поток — в отдельном потоке
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+# Атрибуты LogRecord, которые есть всегда; всё остальное пришло через extra={...} — это поля события
+_STANDARD_ATTRS = set(logging.LogRecord("", 0, "", 0, "", None, None).__dict__) | {"message", "asctime", "taskName"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        event = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                event[key] = value
+        if record.exc_info:
+            event["exc"] = self.formatException(record.exc_info)
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Для локального запуска: «время уровень логгер: сообщение key=value ...»."""
+
+    def format(self, record):
+        fields = " ".join(
+            f"{k}={v}" for k, v in record.__dict__.items() if k not in _STANDARD_ATTRS and not k.startswith("_")
+        )
+        line = f"{self.formatTime(record, '%H:%M:%S')} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        if fields:
+            line += " " + fields
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def setup(level=None, fmt=None):
+    """
+    Корневой логгер пишет через QueueHandler: вызов log.info() в event loop только
+    форматирует запись и кладёт её в очередь, вывод делает QueueListener в своём потоке.
+    Уровень и формат — LOG_LEVEL (INFO) и LOG_FORMAT (json | text).
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    fmt = fmt or os.getenv("LOG_FORMAT", "json")
+    records = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(records)
+    # Форматируем в вызывающем потоке (нужны живые exc_info), поток-писатель выводит готовую строку
+    queue_handler.setFormatter(TextFormatter() if fmt == "text" else JsonFormatter())
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter("%(message)s"))
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+    _listener = logging.handlers.QueueListener(records, stream)
+    _listener.start()
+    return _listener
+
+
+def shutdown():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
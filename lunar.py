@@ -0,0 +1,196 @@
+# lunar.py — лунный посевной календарь: фазы и знаки зодиака Луны без внешних API
+import math
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+
+SIGNS = ["Овен", "Телец", "Близнецы", "Рак", "Лев", "Дева", "Весы", "Скорпион", "Стрелец", "Козерог", "Водолей", "Рыбы"]
+MONTHS = ["Январь", "Февраль", "Март", "Апрель", "Май", "Июнь", "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь"]
+
+# Фаза дня: новолуние / растущая / полнолуние / убывающая
+NEW_MOON, WAXING, FULL_MOON, WANING = 0, 1, 2, 3
+PHASE_NAMES = ["🌑 новолуние", "🌒 растущая", "🌕 полнолуние", "🌘 убывающая"]
+
+# Группы культур и оценки дней: 2 — благоприятный, 1 — нейтральный, 0 — неблагоприятный
+TOPS, ROOTS, FLOWERS, TREES = "вершки", "корешки", "цветы", "деревья"
+GROUPS = (TOPS, ROOTS, FLOWERS, TREES)
+FERTILE = {"Рак", "Скорпион", "Рыбы", "Телец", "Козерог", "Весы"}
+BARREN = {"Овен", "Близнецы", "Лев", "Стрелец", "Водолей"}
+GROUP_SIGNS = {
+    TOPS: FERTILE,
+    ROOTS: FERTILE,
+    FLOWERS: {"Дева", "Весы", "Телец", "Рак", "Рыбы", "Скорпион"},
+    TREES: {"Телец", "Рак", "Козерог", "Весы", "Скорпион", "Рыбы"},
+}
+GROUP_PHASE = {TOPS: WAXING, ROOTS: WANING, FLOWERS: WAXING, TREES: WAXING}
+ROOT_CROPS = ("Морковь", "Свёкла", "Картофель", "Лук", "Чеснок")
+
+
+def culture_group(category: str, culture: str) -> str:
+    """Группа культуры по категории из CATEGORIES (корнеплоды и луковичные — «корешки»)."""
+    if any(name in culture for name in ROOT_CROPS):
+        return ROOTS
+    if "Цвет" in category:
+        return FLOWERS
+    if "Кустарник" in category or "дерев" in category:
+        return TREES
+    return TOPS
+
+
+# ─── Астрономия (упрощённые ряды Меуса, точность ~0.1° — с запасом для знака) ───
+def _julian_day(dt: datetime) -> float:
+    return dt.timestamp() / 86400.0 + 2440587.5
+
+
+def _sun_longitude(t: float) -> float:
+    l0 = 280.46646 + 36000.76983 * t
+    m = math.radians(357.52911 + 35999.05029 * t)
+    c = (1.914602 - 0.004817 * t) * math.sin(m) + (0.019993 - 0.000101 * t) * math.sin(2 * m) + 0.000289 * math.sin(3 * m)
+    return (l0 + c) % 360.0
+
+
+# (коэффициент, D, M, M', F) — основные периодические члены долготы Луны
+_MOON_TERMS = (
+    (6.288774, 0, 0, 1, 0), (1.274027, 2, 0, -1, 0), (0.658314, 2, 0, 0, 0), (0.213618, 0, 0, 2, 0),
+    (-0.185116, 0, 1, 0, 0), (-0.114332, 0, 0, 0, 2), (0.058793, 2, 0, -2, 0), (0.057066, 2, -1, -1, 0),
+    (0.053322, 2, 0, 1, 0), (0.045758, 2, -1, 0, 0), (-0.040923, 0, 1, -1, 0), (-0.034720, 1, 0, 0, 0),
+    (-0.030383, 0, 1, 1, 0), (0.015327, 2, 0, 0, -2), (-0.012528, 0, 0, 1, 2), (0.010980, 0, 0, 1, -2),
+    (0.010675, 4, 0, -1, 0), (0.010034, 0, 0, 3, 0), (0.008548, 4, 0, -2, 0), (-0.007888, 2, 1, -1, 0),
+    (-0.006766, 2, 1, 0, 0), (-0.005163, 1, 0, -1, 0), (0.004987, 1, 1, 0, 0), (0.004036, 2, -1, 1, 0),
+)
+
+
+def _moon_longitude(t: float) -> float:
+    lp = 218.3164477 + 481267.88123421 * t
+    d = math.radians(297.8501921 + 445267.1114034 * t)
+    m = math.radians(357.5291092 + 35999.0502909 * t)
+    mp = math.radians(134.9633964 + 477198.8675055 * t)
+    f = math.radians(93.2720950 + 483202.0175233 * t)
+    lon = lp
+    for coef, kd, km, kmp, kf in _MOON_TERMS:
+        lon += coef * math.sin(kd * d + km * m + kmp * mp + kf * f)
+    return lon % 360.0
+
+
+def moon_position(dt: datetime):
+    """(эклиптическая долгота Луны, элонгация Луна−Солнце) в градусах для момента dt (aware)."""
+    t = (_julian_day(dt) - 2451545.0) / 36525.0
+    moon = _moon_longitude(t)
+    return moon, (moon - _sun_longitude(t)) % 360.0
+
+
+# ─── Таблица на год ───
+def _day_code(day: date, tz: timezone) -> int:
+    """Байт дня: знак (старшие 4 бита) + фаза (младшие 2 бита)."""
+    start = datetime(day.year, day.month, day.day, tzinfo=tz)
+    _, elong_start = moon_position(start)
+    _, elong_end = moon_position(start + timedelta(days=1))
+    moon_noon, elong_noon = moon_position(start + timedelta(hours=12))
+    if elong_end < elong_start:  # элонгация перешла через 0° в течение суток
+        phase = NEW_MOON
+    elif elong_start < 180.0 <= elong_end:
+        phase = FULL_MOON
+    elif elong_noon < 180.0:
+        phase = WAXING
+    else:
+        phase = WANING
+    return (int(moon_noon // 30) << 4) | phase
+
+
+def _score(code: int, group: str) -> int:
+    phase = code & 3
+    sign = SIGNS[code >> 4]
+    if phase in (NEW_MOON, FULL_MOON) or sign in BARREN:
+        return 0
+    if phase == GROUP_PHASE[group] and sign in GROUP_SIGNS[group]:
+        return 2
+    return 1
+
+
+# Оценка для каждой группы по байту дня — считается один раз
+_SCORES = {g: bytes(_score(code, g) if (code >> 4) < 12 else 0 for code in range(256)) for g in GROUPS}
+
+
+class YearTable:
+    """Компактная таблица года: один байт на день + оценки по группам культур."""
+
+    def __init__(self, year: int, utc_offset: int):
+        self.year = year
+        tz = timezone(timedelta(hours=utc_offset))
+        first = date(year, 1, 1)
+        n_days = (date(year + 1, 1, 1) - first).days
+        self.days = bytes(_day_code(first + timedelta(days=i), tz) for i in range(n_days))
+        self.scores = {g: self.days.translate(_SCORES[g]) for g in GROUPS}
+
+    def _index(self, day: date) -> int:
+        return (day - date(self.year, 1, 1)).days
+
+    def phase(self, day: date) -> int:
+        return self.days[self._index(day)] & 3
+
+    def sign(self, day: date) -> str:
+        return SIGNS[self.days[self._index(day)] >> 4]
+
+    def score(self, day: date, group: str) -> int:
+        return self.scores[group][self._index(day)]
+
+    def month_days(self, month: int, group: str, score: int):
+        """Числа месяца с оценкой score для группы."""
+        start = self._index(date(self.year, month, 1))
+        end = self._index(date(self.year + 1, 1, 1) if month == 12 else date(self.year, month + 1, 1))
+        return [i - start + 1 for i in range(start, end) if self.scores[group][i] == score]
+
+    def forbidden_days(self, month: int):
+        start = self._index(date(self.year, month, 1))
+        end = self._index(date(self.year + 1, 1, 1) if month == 12 else date(self.year, month + 1, 1))
+        return [i - start + 1 for i in range(start, end) if self.days[i] & 3 in (NEW_MOON, FULL_MOON)]
+
+
+@lru_cache(maxsize=32)
+def year_table(year: int, utc_offset: int = 3) -> YearTable:
+    return YearTable(year, utc_offset)
+
+
+# ─── Тексты для бота ───
+def _ranges(days) -> str:
+    """[1, 2, 3, 7, 9, 10] → «1–3, 7, 9–10»."""
+    if not days:
+        return "—"
+    parts = []
+    start = prev = days[0]
+    for d in days[1:] + [None]:
+        if d is not None and d == prev + 1:
+            prev = d
+            continue
+        parts.append(str(start) if start == prev else f"{start}–{prev}")
+        if d is not None:
+            start = prev = d
+    return ", ".join(parts)
+
+
+def format_year_calendar(year: int, utc_offset: int = 3, from_month: int = 1) -> str:
+    table = year_table(year, utc_offset)
+    lines = [f"🌙 Лунный посевной календарь на {year} год"]
+    for month in range(from_month, 13):
+        lines.append(
+            f"*{MONTHS[month - 1]}*: Благоприятные для вершков: {_ranges(table.month_days(month, TOPS, 2))}; "
+            f"для корешков: {_ranges(table.month_days(month, ROOTS, 2))}; "
+            f"Запрещённые: {_ranges(table.forbidden_days(month))}"
+        )
+    return "\n".join(lines)
+
+
+def format_culture_calendar(culture: str, group: str, start: date, months: int = 3, utc_offset: int = 3) -> str:
+    lines = [f"🌙 {culture} ({group}) — лунный календарь посадок"]
+    year, month = start.year, start.month
+    for _ in range(months):
+        table = year_table(year, utc_offset)
+        lines.append(
+            f"*{MONTHS[month - 1]} {year}*: благоприятные: {_ranges(table.month_days(month, group, 2))}; "
+            f"неблагоприятные: {_ranges(table.month_days(month, group, 0))}"
+        )
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+    today = year_table(start.year, utc_offset)
+    lines.append(f"\nСегодня: Луна в знаке {today.sign(start)}, {PHASE_NAMES[today.phase(start)]}")
+    return "\n".join(lines)
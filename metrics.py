@@ -0,0 +1,149 @@
+# metrics.py — метрики в памяти процесса и их выдача в текстовом формате Prometheus
+import time
+from bisect import bisect_left
+
+# Границы подобраны под наши задержки: от миллисекунд (SQLite) до десятков секунд (GPT, PlantNet)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels_text(self.label_names, key)} {value:g}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """Значение задаётся set() или считается функцией в момент выдачи (set_function)."""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = float(value)
+
+    def set_function(self, fn, **labels):
+        self._functions[self._key(labels)] = fn
+
+    def render(self):
+        for key, fn in self._functions.items():
+            try:
+                self._values[key] = float(fn())
+            except Exception:
+                pass
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        item = self._values.get(key)
+        if item is None:
+            # [счётчики по корзинам (+Inf последняя), сумма, количество]
+            item = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        item[0][bisect_left(self.buckets, value)] += 1
+        item[1] += value
+        item[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{self.name}_bucket{_labels_text(self.label_names, key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels_text(self.label_names, key)} {total:g}")
+            lines.append(f"{self.name}_count{_labels_text(self.label_names, key)} {count}")
+        return lines
+
+
+class _Timer:
+    """with HIST.time(label=...): — длительность блока; при исключении добавляется outcome="error"."""
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        labels = self.labels
+        if "outcome" in self.histogram.label_names:
+            labels = {"outcome": "error" if exc_type else "ok", **labels}
+        self.histogram.observe(time.perf_counter() - self.started, **labels)
+        return False
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ─── Метрики бота ───
+EXTERNAL_LATENCY = Histogram(
+    "agro_external_request_seconds", "Время запроса к внешнему API", ("upstream", "outcome")
+)
+HANDLER_DURATION = Histogram(
+    "agro_update_handler_seconds", "Время обработки апдейта Telegram", ("update_type", "outcome")
+)
+SCHEDULER_LAG = Histogram(
+    "agro_scheduler_lag_seconds", "Опоздание срабатывания таймера относительно срока", ("timer",),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0)
+)
+STORAGE_WRITE = Histogram(
+    "agro_storage_write_seconds", "Время записи в хранилище", ("op",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+)
+QUEUE_DEPTH = Gauge("agro_queue_depth", "Длина внутренних очередей", ("queue",))
+EVENTS = Counter("agro_events_total", "Счётчики событий", ("event",))
+STARTUP_SECONDS = Gauge("agro_startup_seconds", "Холодный старт: секунды от импорта до этапа", ("phase",))
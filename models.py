@@ -0,0 +1,89 @@
+# models.py — компактные записи пользователя и напоминания: слоты вместо словарей, целые вместо ISO-строк
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+_EPOCH = datetime(1970, 1, 1)
+
+# Поля диалога и места, которые хранятся JSON-ом в users.profile (region — отдельной колонкой)
+PROFILE_FIELDS = (
+    "tz", "place", "lat", "lon",
+    "state", "temp_rem_text", "temp_rem_date", "temp_rem_id", "edit_field",
+    "reminders_created", "alerts",
+)
+
+
+def local_to_int(dt: datetime) -> int:
+    """Местное время без пояса → целые секунды от 1970-01-01 по тем же часам (обратимо, без учёта пояса)."""
+    return int((dt - _EPOCH).total_seconds())
+
+
+def int_to_local(value: int) -> datetime:
+    return _EPOCH + timedelta(seconds=value)
+
+
+def _intern(value):
+    # Регионов, поясов и состояний — десятки на всех пользователей: одна строка на всех
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+@dataclass(slots=True)
+class User:
+    region: str | None = None
+    tz: str | None = None
+    place: str | None = None
+    lat: float | None = None
+    lon: float | None = None
+    state: str | None = None
+    temp_rem_text: str | None = None
+    temp_rem_date: int | None = None  # date.toordinal() выбранного дня
+    temp_rem_id: int | None = None
+    edit_field: str | None = None
+    reminders_created: int = 0
+    alerts: bool = False  # подписка на предупреждения о заморозках, жаре и ливнях (/alerts)
+    extra: dict | None = None  # незнакомые поля старых профилей — сохраняются как были
+
+    @classmethod
+    def from_profile(cls, region, profile: dict) -> "User":
+        profile = dict(profile)
+        user = cls(region=_intern(region))
+        for name in PROFILE_FIELDS:
+            if name in profile:
+                setattr(user, name, profile.pop(name))
+        user.tz = _intern(user.tz)
+        user.place = _intern(user.place)
+        user.state = _intern(user.state)
+        if isinstance(user.temp_rem_date, str):  # профили до перехода на целые даты
+            user.temp_rem_date = datetime.fromisoformat(user.temp_rem_date).toordinal()
+        user.extra = profile or None
+        return user
+
+    def to_profile(self) -> dict:
+        """JSON для users.profile: только заполненные поля."""
+        profile = dict(self.extra) if self.extra else {}
+        for name in PROFILE_FIELDS:
+            value = getattr(self, name)
+            if value is not None:
+                profile[name] = value
+        if not self.reminders_created:
+            profile.pop("reminders_created", None)
+        if not self.alerts:
+            profile.pop("alerts", None)  # по умолчанию выключены — храним только подписку
+        return profile
+
+    def clear_dialog(self):
+        """Выход из любого многошагового диалога (создание / правка напоминания и т. п.)."""
+        self.state = self.temp_rem_text = self.temp_rem_date = self.temp_rem_id = self.edit_field = None
+
+
+@dataclass(slots=True)
+class Reminder:
+    id: int
+    text: str
+    local_dt: int  # местное время срабатывания, см. local_to_int
+    due_at: int  # unix time
+    sent: bool = False
+
+    @property
+    def local(self) -> datetime:
+        return int_to_local(self.local_dt)
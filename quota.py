@@ -0,0 +1,106 @@
+# quota.py — дневные лимиты бесплатных функций и премиум: проверка и списание за O(1)
+import asyncio
+import time
+
+from metrics import STORAGE_WRITE
+
+PREMIUM_REMAINING = 999
+MAX_COUNTERS = 100000  # после сброса на диск лишние чистые счётчики выкидываются из памяти
+
+
+class QuotaEngine:
+    """
+    Лимиты считаются в памяти: проверка и списание — один синхронный вызов без await,
+    поэтому на event loop они атомарны и для одновременных апдейтов одного пользователя.
+    Изменённые счётчики пишутся в базу пачкой раз в flush_interval.
+    В режиме нескольких воркеров (shared) память у процессов разная — тогда списание
+    идёт одним условным UPDATE в общей базе, а срок премиума перечитывается раз в premium_refresh.
+    День — календарный день пользователя (его часовой пояс), его передаёт вызывающий.
+    """
+
+    def __init__(self, repo, limits, flush_interval=5.0, shared=False, premium_refresh=5.0):
+        self.repo = repo
+        self.limits = limits
+        self.flush_interval = flush_interval
+        self.shared = shared
+        self.premium_refresh = premium_refresh if shared else None
+        self._premium = {}  # uid -> (until или 0.0, когда прочитано)
+        self._counters = {}  # (uid, feature) -> [day, count]
+        self._dirty = set()
+
+    # ─── Премиум ───
+    def premium_until(self, uid) -> float:
+        now = time.monotonic()
+        item = self._premium.get(uid)
+        if item is None or (self.premium_refresh is not None and now - item[1] > self.premium_refresh):
+            item = (self.repo.premium_until(uid) or 0.0, now)
+            self._premium[uid] = item
+        return item[0]
+
+    def is_premium(self, uid) -> bool:
+        return time.time() < self.premium_until(uid)
+
+    def set_premium(self, uid, until_ts):
+        self.repo.set_premium(uid, until_ts)
+        self._premium[uid] = (until_ts, time.monotonic())
+
+    def clear_premium_many(self, pairs):
+        for uid, _ in pairs:
+            self._premium.pop(uid, None)
+        return self.repo.clear_premium_many(pairs)
+
+    # ─── Счётчики ───
+    def _counter(self, uid, feature, day):
+        key = (uid, feature)
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = self._counters[key] = [day, self.repo.get_usage(uid, feature, day)]
+        elif counter[0] != day:
+            counter[0], counter[1] = day, 0  # новый день у пользователя
+        return counter
+
+    def peek(self, uid, feature, day):
+        """(можно ли, сколько останется после использования) — без списания."""
+        if self.is_premium(uid):
+            return True, PREMIUM_REMAINING
+        limit = self.limits.get(feature, PREMIUM_REMAINING)
+        count = self.repo.get_usage(uid, feature, day) if self.shared else self._counter(uid, feature, day)[1]
+        if count >= limit:
+            return False, 0
+        return True, limit - count - 1
+
+    def try_consume(self, uid, feature, day):
+        """Проверка и списание одним шагом: (списано ли, сколько осталось)."""
+        if self.is_premium(uid):
+            return True, PREMIUM_REMAINING
+        limit = self.limits.get(feature, PREMIUM_REMAINING)
+        if self.shared:
+            count = self.repo.consume_usage(uid, feature, day, limit)
+            if count is None:
+                return False, 0
+            return True, limit - count
+        counter = self._counter(uid, feature, day)
+        if counter[1] >= limit:
+            return False, 0
+        counter[1] += 1
+        self._dirty.add((uid, feature))
+        return True, limit - counter[1]
+
+    def flush(self):
+        if not self._dirty:
+            return 0
+        rows = [(uid, feature, *self._counters[(uid, feature)]) for uid, feature in self._dirty]
+        self._dirty.clear()
+        with STORAGE_WRITE.time(op="usage_flush"):
+            self.repo.set_usage_many(rows)
+        if len(self._counters) > MAX_COUNTERS:
+            self._counters.clear()
+        return len(rows)
+
+    async def run_flusher(self):
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                self.flush()
+        finally:
+            self.flush()
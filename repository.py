@@ -0,0 +1,389 @@
+# repository.py — хранилище пользователей на SQLite
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+from models import Reminder, User, local_to_int
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    uid TEXT PRIMARY KEY,
+    region TEXT,
+    profile TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS reminders (
+    uid TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    local_dt TEXT NOT NULL,
+    due_at REAL NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_until REAL,
+    PRIMARY KEY (uid, id)
+);
+CREATE INDEX IF NOT EXISTS reminders_due ON reminders (sent, due_at);
+CREATE TABLE IF NOT EXISTS usage (
+    uid TEXT NOT NULL,
+    feature TEXT NOT NULL,
+    day TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (uid, feature)
+);
+CREATE TABLE IF NOT EXISTS premium (
+    uid TEXT PRIMARY KEY,
+    until REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS premium_until ON premium (until);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS seen_updates (
+    update_id INTEGER PRIMARY KEY,
+    seen_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS weather_alerts (
+    key TEXT PRIMARY KEY,
+    sent_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    until REAL NOT NULL
+);
+"""
+BUSY_TIMEOUT = 5.0  # сколько ждать блокировку записи от другого воркера
+
+
+def _reminder(row):
+    return Reminder(
+        row["id"], row["text"], local_to_int(datetime.fromisoformat(row["local_dt"])), int(row["due_at"]), bool(row["sent"])
+    )
+
+
+class Repository:
+    """
+    Пользователи, напоминания, счётчики лимитов и премиум в одной SQLite-базе.
+    Поля диалога (state, temp_*) хранятся JSON-ом в users.profile,
+    всё, по чему нужны выборки, — в отдельных таблицах с индексами.
+    Наружу отдаются models.User / models.Reminder: перевод из строк и JSON — только здесь.
+    Базу могут делить несколько процессов (uvicorn --workers): WAL + busy_timeout,
+    а отправку напоминаний и снятие премиума забирает себе ровно один из них.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(f"PRAGMA busy_timeout={int(BUSY_TIMEOUT * 1000)}")
+        self.conn.executescript(SCHEMA)
+        self._upgrade()
+        self._lock = threading.RLock()
+
+    def _upgrade(self):
+        # Базы, созданные до появления аренды напоминаний
+        cols = {r["name"] for r in self.conn.execute("PRAGMA table_info(reminders)")}
+        with self.conn:
+            for col, kind in (("lease_owner", "TEXT"), ("lease_until", "REAL")):
+                if col not in cols:
+                    self.conn.execute(f"ALTER TABLE reminders ADD COLUMN {col} {kind}")
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    # ─── Пользователи ───
+    def get_user(self, uid):
+        """User (регион + поля диалога) или None."""
+        with self._lock:
+            row = self.conn.execute("SELECT region, profile FROM users WHERE uid = ?", (uid,)).fetchone()
+        if row is None:
+            return None
+        return User.from_profile(row["region"], json.loads(row["profile"]))
+
+    def ensure_user(self, uid):
+        user = self.get_user(uid)
+        if user is None:
+            user = User()
+            self.save_user(uid, user)
+        return user
+
+    def save_user(self, uid, user):
+        profile = user.to_profile()
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO users (uid, region, profile) VALUES (?, ?, ?) "
+                "ON CONFLICT(uid) DO UPDATE SET region = excluded.region, profile = excluded.profile",
+                (uid, user.region, json.dumps(profile, ensure_ascii=False, separators=(",", ":")))
+            )
+
+    def forecast_targets(self):
+        """(uid, region, place, lat, lon, подписан на предупреждения) всех пользователей с регионом."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT uid, region, json_extract(profile, '$.place'), json_extract(profile, '$.lat'), "
+                "json_extract(profile, '$.lon'), COALESCE(json_extract(profile, '$.alerts'), 0) = 1 FROM users "
+                "WHERE region IS NOT NULL AND region != ''"
+            ).fetchall()
+        return [tuple(r) for r in rows]
+
+    # ─── Лимиты ───
+    def get_usage(self, uid, feature, day):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT day, count FROM usage WHERE uid = ? AND feature = ?", (uid, feature)
+            ).fetchone()
+        if row is None or row["day"] != day:
+            return 0
+        return row["count"]
+
+    def set_usage_many(self, rows):
+        """Пачка счётчиков (uid, feature, day, count) одной транзакцией."""
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO usage (uid, feature, day, count) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(uid, feature) DO UPDATE SET day = excluded.day, count = excluded.count",
+                rows
+            )
+
+    def consume_usage(self, uid, feature, day, limit):
+        """Атомарное списание с проверкой лимита в базе: новый счётчик или None, если лимит исчерпан."""
+        with self._lock, self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO usage (uid, feature, day, count) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT(uid, feature) DO UPDATE SET "
+                "count = CASE WHEN usage.day = excluded.day THEN usage.count + 1 ELSE 1 END, "
+                "day = excluded.day "
+                "WHERE usage.day != excluded.day OR usage.count < ?",
+                (uid, feature, day, limit)
+            )
+            if cur.rowcount == 0:
+                return None
+            row = self.conn.execute(
+                "SELECT count FROM usage WHERE uid = ? AND feature = ?", (uid, feature)
+            ).fetchone()
+        return row["count"]
+
+    # ─── Премиум ───
+    def premium_until(self, uid):
+        """Окончание премиума (unix time) или None."""
+        with self._lock:
+            row = self.conn.execute("SELECT until FROM premium WHERE uid = ?", (uid,)).fetchone()
+        return row["until"] if row else None
+
+    def set_premium(self, uid, until_ts):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO premium (uid, until) VALUES (?, ?) "
+                "ON CONFLICT(uid) DO UPDATE SET until = excluded.until",
+                (uid, until_ts)
+            )
+
+    def all_premium(self):
+        """(uid, until) всех активных премиумов — для таймеров при старте."""
+        with self._lock:
+            rows = self.conn.execute("SELECT uid, until FROM premium").fetchall()
+        return [(r["uid"], r["until"]) for r in rows]
+
+    def clear_premium_many(self, pairs):
+        """
+        Снимает пачку истёкших премиумов (uid, until) одной транзакцией.
+        Возвращает те пары, которые удалил именно этот вызов (продлённые и чужие пропускаются).
+        """
+        removed = []
+        with self._lock, self.conn:
+            for uid, until in pairs:
+                cur = self.conn.execute("DELETE FROM premium WHERE uid = ? AND until = ?", (uid, until))
+                if cur.rowcount:
+                    removed.append((uid, until))
+        return removed
+
+    def expired_premium(self, now_ts):
+        """Пары (uid, until) с истёкшим премиумом — по индексу premium_until."""
+        with self._lock:
+            rows = self.conn.execute("SELECT uid, until FROM premium WHERE until <= ?", (now_ts,)).fetchall()
+        return [(r["uid"], r["until"]) for r in rows]
+
+    # ─── Напоминания ───
+    def list_reminders(self, uid):
+        with self._lock:
+            rows = self.conn.execute("SELECT * FROM reminders WHERE uid = ? ORDER BY id", (uid,)).fetchall()
+        return [_reminder(r) for r in rows]
+
+    def get_reminder(self, uid, rem_id):
+        with self._lock:
+            row = self.conn.execute("SELECT * FROM reminders WHERE uid = ? AND id = ?", (uid, rem_id)).fetchone()
+        return _reminder(row) if row else None
+
+    def add_reminder(self, uid, text, local_dt, due_at):
+        """local_dt — местное время (datetime без пояса), due_at — unix time."""
+        with self._lock, self.conn:
+            row = self.conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM reminders WHERE uid = ?", (uid,)).fetchone()
+            new_id = row[0]
+            self.conn.execute(
+                "INSERT INTO reminders (uid, id, text, local_dt, due_at, sent) VALUES (?, ?, ?, ?, ?, 0)",
+                (uid, new_id, text, local_dt.isoformat(), int(due_at))
+            )
+        return new_id
+
+    def update_reminder(self, uid, rem_id, **fields):
+        """Обновляет text / local_dt (datetime) / due_at / sent. Возвращает True, если запись есть."""
+        allowed = ("text", "local_dt", "due_at", "sent")
+        cols = [k for k in fields if k in allowed]
+        if "local_dt" in fields:
+            fields["local_dt"] = fields["local_dt"].isoformat()
+        if "due_at" in fields:
+            fields["due_at"] = int(fields["due_at"])
+        if not cols:
+            return False
+        sets = [f"{c} = ?" for c in cols]
+        if "due_at" in cols:
+            sets.append("lease_owner = NULL, lease_until = NULL")  # перенесённое напоминание снова свободно
+        sql = "UPDATE reminders SET " + ", ".join(sets) + " WHERE uid = ? AND id = ?"
+        with self._lock, self.conn:
+            cur = self.conn.execute(sql, [fields[c] for c in cols] + [uid, rem_id])
+        return cur.rowcount > 0
+
+    def delete_reminder(self, uid, rem_id):
+        with self._lock, self.conn:
+            cur = self.conn.execute("DELETE FROM reminders WHERE uid = ? AND id = ?", (uid, rem_id))
+        return cur.rowcount > 0
+
+    def pending_reminders(self):
+        """(uid, id, due_at) всех неотправленных напоминаний — для очереди таймеров."""
+        with self._lock:
+            rows = self.conn.execute("SELECT uid, id, due_at FROM reminders WHERE sent = 0").fetchall()
+        return [(r["uid"], r["id"], r["due_at"]) for r in rows]
+
+    def due_reminders(self, now_ts):
+        """(uid, id, due_at) наступивших и никем не арендованных — страховка для нескольких воркеров."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT uid, id, due_at FROM reminders WHERE sent = 0 AND due_at <= ? "
+                "AND (lease_until IS NULL OR lease_until < ?)",
+                (now_ts, now_ts)
+            ).fetchall()
+        return [(r["uid"], r["id"], r["due_at"]) for r in rows]
+
+    def claim_reminder(self, uid, rem_id, owner, now_ts, lease_seconds=60.0):
+        """
+        Атомарно берёт наступившее напоминание в аренду на lease_seconds.
+        True — отправлять этому воркеру; если он упадёт, аренда истечёт и напоминание заберёт другой.
+        """
+        with self._lock, self.conn:
+            cur = self.conn.execute(
+                "UPDATE reminders SET lease_owner = ?, lease_until = ? "
+                "WHERE uid = ? AND id = ? AND sent = 0 AND due_at <= ? "
+                "AND (lease_until IS NULL OR lease_until < ?)",
+                (owner, now_ts + lease_seconds, uid, rem_id, now_ts, now_ts)
+            )
+        return cur.rowcount > 0
+
+    def release_reminder(self, uid, rem_id, owner):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE reminders SET lease_owner = NULL, lease_until = NULL "
+                "WHERE uid = ? AND id = ? AND lease_owner = ?",
+                (uid, rem_id, owner)
+            )
+
+    def mark_reminder_sent(self, uid, rem_id):
+        return self.update_reminder(uid, rem_id, sent=1)
+
+    # ─── Апдейты Telegram ───
+    def claim_update(self, update_id, now_ts):
+        """True — апдейт ещё не принимал ни один воркер (ретраи Telegram попадают к разным)."""
+        with self._lock, self.conn:
+            cur = self.conn.execute(
+                "INSERT OR IGNORE INTO seen_updates (update_id, seen_at) VALUES (?, ?)", (update_id, now_ts)
+            )
+        return cur.rowcount > 0
+
+    def unclaim_update(self, update_id):
+        """Снимает отметку: апдейт не принят (очередь полна), повтор Telegram должен пройти."""
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM seen_updates WHERE update_id = ?", (update_id,))
+
+    def forget_updates(self, before_ts):
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM seen_updates WHERE seen_at < ?", (before_ts,))
+
+    # ─── Предупреждения о погоде ───
+    def claim_alert(self, key, now_ts):
+        """True — такое предупреждение (кластер, вид, день) ещё никто не рассылал."""
+        with self._lock, self.conn:
+            cur = self.conn.execute("INSERT OR IGNORE INTO weather_alerts (key, sent_at) VALUES (?, ?)", (key, now_ts))
+        return cur.rowcount > 0
+
+    def forget_alerts(self, before_ts):
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM weather_alerts WHERE sent_at < ?", (before_ts,))
+
+    # ─── Аренда фоновых задач ───
+    def claim_lease(self, name, owner, now_ts, lease_seconds):
+        """
+        Берёт или продлевает аренду задачи name на lease_seconds.
+        True — задачу выполняет этот воркер; если он упадёт, аренда истечёт и её возьмёт другой.
+        """
+        with self._lock, self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO leases (name, owner, until) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, until = excluded.until "
+                "WHERE leases.owner = excluded.owner OR leases.until < ?",
+                (name, owner, now_ts + lease_seconds, now_ts)
+            )
+        return cur.rowcount > 0
+
+    # ─── Миграция из data.json ───
+    def is_migrated(self):
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'migrated_from_json'").fetchone()
+        return row is not None
+
+    def migrate_from_dict(self, data, due_at_fn, premium_ts_fn):
+        """
+        Однократный перенос старого формата {uid: {...}}.
+        due_at_fn(region, local_iso) -> unix time срабатывания напоминания,
+        premium_ts_fn(iso) -> unix time окончания премиума.
+        """
+        with self._lock, self.conn:
+            for uid, user in data.items():
+                user = dict(user)
+                region = user.get("region")
+                for rem in user.pop("reminders", []):
+                    try:
+                        due_at = due_at_fn(region or "", rem["datetime"])
+                    except Exception:
+                        continue
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO reminders (uid, id, text, local_dt, due_at, sent) VALUES (?, ?, ?, ?, ?, ?)",
+                        (uid, rem.get("id", 0), rem.get("text", ""), rem["datetime"], due_at, int(bool(rem.get("sent"))))
+                    )
+                premium = user.pop("premium", False)
+                until = user.pop("premium_until", None)
+                if premium and until:
+                    try:
+                        self.conn.execute(
+                            "INSERT OR REPLACE INTO premium (uid, until) VALUES (?, ?)", (uid, premium_ts_fn(until))
+                        )
+                    except Exception:
+                        pass
+                for key in [k for k in user if k.endswith("_last_date")]:
+                    feature = key[:-len("_last_date")]
+                    day = user.pop(key)
+                    count = user.pop(f"{feature}_count", 0)
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO usage (uid, feature, day, count) VALUES (?, ?, ?, ?)",
+                        (uid, feature, day, count)
+                    )
+                profile = {k: v for k, v in user.items() if k != "region"}
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO users (uid, region, profile) VALUES (?, ?, ?)",
+                    (uid, region, json.dumps(profile, ensure_ascii=False, separators=(",", ":")))
+                )
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_json', ?)", (str(len(data)),))
+        return len(data)
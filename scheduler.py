@@ -0,0 +1,56 @@
+# scheduler.py — очередь таймеров по абсолютному времени (min-heap)
+import heapq
+import itertools
+
+
+class TimerQueue:
+    """
+    Ключи с абсолютным временем срабатывания (unix time).
+    Перенос и отмена — O(log n): старые записи в куче не удаляются,
+    а пропускаются при извлечении (у каждой своя метка seq).
+    Без блокировок: очередью владеет event loop, все вызовы — из его потока.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._entries = {}  # key -> (due_at, seq) актуальной записи
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def schedule(self, key, due_at):
+        """Ставит (или переносит) ключ на момент due_at."""
+        seq = next(self._seq)
+        self._entries[key] = (due_at, seq)
+        heapq.heappush(self._heap, (due_at, seq, key))
+
+    def cancel(self, key):
+        return self._entries.pop(key, None) is not None
+
+    def _drop_stale(self):
+        while self._heap:
+            due_at, seq, key = self._heap[0]
+            if self._entries.get(key) == (due_at, seq):
+                return
+            heapq.heappop(self._heap)
+
+    def next_due(self):
+        """Время ближайшего срабатывания или None, если очередь пуста."""
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due_items(self, now):
+        """Извлекает все (ключ, срок) со сроком <= now (в порядке срока)."""
+        due = []
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                break
+            due_at, _, key = heapq.heappop(self._heap)
+            del self._entries[key]
+            due.append((key, due_at))
+        return due
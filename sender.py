@@ -0,0 +1,225 @@
+# sender.py — исходящие сообщения бота с учётом лимитов Telegram и приоритетов
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+PRIORITY_PAYMENT, PRIORITY_REMINDER, PRIORITY_BROADCAST = 0, 1, 2
+PRIORITY_NAMES = {PRIORITY_PAYMENT: "payment", PRIORITY_REMINDER: "reminder", PRIORITY_BROADCAST: "broadcast"}
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше burst про запас."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now=None) -> float:
+        """Через сколько секунд будет токен (0 — уже есть)."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def full(self, now) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+    def take(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Job:
+    __slots__ = ("chat_id", "text", "kwargs", "priority", "future", "attempts", "queued_at")
+
+    def __init__(self, chat_id, text, kwargs, priority, future):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.priority = priority
+        self.future = future
+        self.attempts = 0
+        self.queued_at = time.monotonic()
+
+
+class TelegramSender:
+    """
+    Очередь исходящих: общий token bucket (лимит бота на рассылку) и по чату,
+    сначала платежи, потом напоминания, потом рассылки. RetryAfter (429) ставит
+    на паузу всю отправку на указанный срок, после чего сообщение уходит повторно.
+    """
+
+    def __init__(self, bot, rate=25.0, per_chat_rate=1.0, per_chat_burst=3, max_in_flight=32, max_attempts=4):
+        self.bot = bot
+        self.bucket = TokenBucket(rate, burst=max(1.0, rate))  # при доле воркера < 1 в секунду токен всё равно копится
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.max_in_flight = max_in_flight
+        self.max_attempts = max_attempts
+        self._seq = itertools.count()
+        self._ready = []  # (priority, seq, job)
+        self._deferred = []  # (когда можно, priority, seq, job) — чат ещё не остыл или ждём повтора
+        self._chats = {}  # chat_id -> TokenBucket
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._paused_until = 0.0
+        self.in_flight = 0
+        self._task = None
+        self._sending = set()
+        self._sent_at = deque()  # моменты отправки за последнюю минуту
+        self.counters = {"sent": 0, "failed": 0, "retried": 0, "retry_after": 0}
+        self.wait_total = 0.0
+
+    def __len__(self):
+        return len(self._ready) + len(self._deferred)
+
+    # ─── API ───
+    def submit(self, chat_id, text, priority=PRIORITY_BROADCAST, **kwargs) -> asyncio.Future:
+        """Поставить сообщение в очередь; future завершится отправленным Message или ошибкой."""
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(chat_id, text, kwargs, priority, future)
+        heapq.heappush(self._ready, (priority, next(self._seq), job))
+        self._wakeup.set()
+        return future
+
+    async def send(self, chat_id, text, priority=PRIORITY_BROADCAST, **kwargs):
+        return await self.submit(chat_id, text, priority, **kwargs)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._dispatch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for _, _, job in self._ready:
+            if not job.future.done():
+                job.future.cancel()
+        for _, _, _, job in self._deferred:
+            if not job.future.done():
+                job.future.cancel()
+        self._ready.clear()
+        self._deferred.clear()
+
+    # ─── Диспетчер ───
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 50000:
+                # Полные ведра ничего не помнят — их можно забыть
+                now = time.monotonic()
+                self._chats = {c: b for c, b in self._chats.items() if not b.full(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+        return bucket
+
+    def _next_job(self, now):
+        """Самое приоритетное сообщение, чей чат готов; остальные откладываются до готовности чата."""
+        while self._deferred and self._deferred[0][0] <= now:
+            _, priority, seq, job = heapq.heappop(self._deferred)
+            heapq.heappush(self._ready, (priority, seq, job))
+        while self._ready:
+            priority, seq, job = heapq.heappop(self._ready)
+            if job.future.done():  # ждущий отменил отправку
+                continue
+            delay = self._chat_bucket(job.chat_id).delay(now)
+            if delay > 0:
+                heapq.heappush(self._deferred, (now + delay, priority, seq, job))
+                continue
+            return job
+        return None
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            wait = max(self._paused_until - now, self.bucket.delay(now))
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            job = self._next_job(now)
+            if job is None:
+                timeout = self._deferred[0][0] - now if self._deferred else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._slots.acquire()
+            self.bucket.take(now)
+            self._chat_bucket(job.chat_id).take(now)
+            self.in_flight += 1
+            task = asyncio.create_task(self._send(job))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, job):
+        try:
+            job.attempts += 1
+            message = await self.bot.send_message(job.chat_id, job.text, **job.kwargs)
+        except RetryAfter as e:
+            self.counters["retry_after"] += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + float(e.retry_after))
+            self._retry(job, e, 0.0)
+        except (Forbidden, BadRequest) as e:
+            # Бот заблокирован / чат не найден — повтор не поможет
+            self._fail(job, e)
+        except NetworkError as e:
+            self._retry(job, e, 2.0 ** job.attempts)
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            now = time.monotonic()
+            self.counters["sent"] += 1
+            self.wait_total += now - job.queued_at
+            self._sent_at.append(now)
+            if not job.future.done():
+                job.future.set_result(message)
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    def _retry(self, job, error, delay):
+        if job.attempts >= self.max_attempts:
+            self._fail(job, error)
+            return
+        self.counters["retried"] += 1
+        heapq.heappush(self._deferred, (time.monotonic() + delay, job.priority, next(self._seq), job))
+        self._wakeup.set()
+
+    def _fail(self, job, error):
+        self.counters["failed"] += 1
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    # ─── Метрики ───
+    def stats(self) -> dict:
+        now = time.monotonic()
+        while self._sent_at and now - self._sent_at[0] > 60:
+            self._sent_at.popleft()
+        by_priority = {name: 0 for name in PRIORITY_NAMES.values()}
+        for item in self._ready:
+            by_priority[PRIORITY_NAMES[item[2].priority]] += 1
+        for item in self._deferred:
+            by_priority[PRIORITY_NAMES[item[3].priority]] += 1
+        return {
+            "queued": len(self),
+            "queued_by_priority": by_priority,
+            "in_flight": self.in_flight,
+            "sent_per_sec_1m": round(len(self._sent_at) / 60, 2),
+            "avg_wait_ms": round(1000 * self.wait_total / self.counters["sent"], 1) if self.counters["sent"] else 0.0,
+            "paused_for": round(max(0.0, self._paused_until - now), 1),
+            **self.counters,
+        }
@@ -0,0 +1,36 @@
+# storage.py — чтение старого хранилища пользователей (снимок data.json + журнал) для миграции в SQLite
+import json
+import logging
+import os
+
+log = logging.getLogger("agro.storage")
+
+
+def load_legacy(path) -> dict:
+    """
+    {uid: запись} из снимка path и журнала path + ".log" (строка на сохранение, user=None — удаление).
+    Только чтение: файлы остаются как были — по ним можно откатиться.
+    """
+    data = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    log_path = path + ".log"
+    replayed = 0
+    if os.path.exists(log_path):
+        with open(log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    # Оборванная последняя строка (падение посреди записи) — всё до неё целое
+                    log.warning("Журнал обрезан", extra={"replayed": replayed})
+                    break
+                if rec.get("user") is None:
+                    data.pop(rec["uid"], None)
+                else:
+                    data[rec["uid"]] = rec["user"]
+                replayed += 1
+    if replayed:
+        log.info("Применены записи журнала", extra={"replayed": replayed})
+    return data
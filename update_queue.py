@@ -0,0 +1,109 @@
+# update_queue.py — очередь входящих апдейтов: webhook отвечает сразу, обработка в воркерах
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+
+ACCEPTED, DUPLICATE, FULL = "accepted", "duplicate", "full"
+log = logging.getLogger("agro.updates")
+
+
+class UpdateQueue:
+    """
+    Ограниченная очередь с порядком внутри чата: апдейты одного чата обрабатываются строго
+    по очереди, разные чаты — параллельно (не больше concurrency одновременно).
+    Повторы по update_id (ретраи Telegram) отбрасываются.
+    """
+
+    def __init__(self, handler, concurrency=16, maxsize=1000, dedup_size=10000):
+        self.handler = handler
+        self.concurrency = concurrency
+        self.maxsize = maxsize
+        self.dedup_size = dedup_size
+        self._seen = OrderedDict()  # update_id -> None, последние dedup_size
+        self._chats = {}  # chat_key -> deque[(enqueued_at, item)]
+        self._ready = asyncio.Queue()  # chat_key, у которых есть работа и нет активного воркера
+        self._workers = []
+        self.depth = 0
+        self.in_flight = 0
+        self.counters = {"accepted": 0, "duplicate": 0, "rejected": 0, "processed": 0, "failed": 0}
+        self.max_depth = 0
+        self.wait_total = 0.0
+
+    def __len__(self):
+        return self.depth
+
+    def full(self) -> bool:
+        return self.depth >= self.maxsize
+
+    def submit(self, update_id, chat_key, item) -> str:
+        if update_id in self._seen:
+            self.counters["duplicate"] += 1
+            return DUPLICATE
+        if self.full():
+            # Не запоминаем update_id: Telegram повторит доставку, когда очередь разгрузится
+            self.counters["rejected"] += 1
+            return FULL
+        self._seen[update_id] = None
+        if len(self._seen) > self.dedup_size:
+            self._seen.popitem(last=False)
+        if chat_key is None:
+            chat_key = ("update", update_id)
+        pending = self._chats.get(chat_key)
+        if pending is None:
+            pending = self._chats[chat_key] = deque()
+            self._ready.put_nowait(chat_key)
+        pending.append((time.monotonic(), item))
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        self.counters["accepted"] += 1
+        return ACCEPTED
+
+    async def _worker(self):
+        while True:
+            chat_key = await self._ready.get()
+            pending = self._chats[chat_key]
+            enqueued_at, item = pending.popleft()
+            self.depth -= 1
+            self.in_flight += 1
+            self.wait_total += time.monotonic() - enqueued_at
+            try:
+                await self.handler(item)
+                self.counters["processed"] += 1
+            except Exception:
+                self.counters["failed"] += 1
+                log.exception("Ошибка обработки апдейта")
+            finally:
+                self.in_flight -= 1
+                # Следующий апдейт этого чата — в конец общей очереди, чтобы не задерживать другие чаты
+                if pending:
+                    self._ready.put_nowait(chat_key)
+                else:
+                    del self._chats[chat_key]
+
+    def start(self):
+        for _ in range(self.concurrency - len(self._workers)):
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    async def stop(self, timeout=10.0):
+        """Даём дообработать накопленное (не дольше timeout), затем останавливаем воркеры."""
+        deadline = time.monotonic() + timeout
+        while (self.depth or self.in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+    def stats(self) -> dict:
+        started = self.counters["processed"] + self.counters["failed"] + self.in_flight
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "capacity": self.maxsize,
+            "in_flight": self.in_flight,
+            "workers": len(self._workers),
+            "chats_waiting": len(self._chats),
+            "avg_wait_ms": round(1000 * self.wait_total / started, 1) if started else 0.0,
+            **self.counters,
+        }